@@ -15,7 +15,9 @@ FLUXO DE DADOS:
 
 ARQUITETURA:
 - Modelos Pydantic: Definem estruturas de dados (requests/responses)
-- Funções de IA: Chamam Gemini API para processamento
+- Funções de IA: Chamam Gemini API para processamento, sempre pelo cliente
+  assíncrono nativo (client.aio) — nenhuma chamada bloqueia o event loop ou
+  passa por thread pool, então requisições concorrentes se sobrepõem na E/S
 - Endpoints: Expõem funcionalidades via REST API
 - Servidor estático: Serve arquivos HTML/CSS/JS
 
@@ -30,77 +32,253 @@ VERSÃO: 2.0
 
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError, field_validator, with_config
+from typing import List, Optional, Dict, Tuple, Union, Literal, AsyncIterator, Callable, Mapping, NamedTuple, Final, TYPE_CHECKING
+from contextlib import AsyncExitStack, asynccontextmanager
+from types import MappingProxyType
+from typing_extensions import TypedDict
 from google import genai
+from google.genai import types, errors
+import httpx
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 import os
 from dotenv import load_dotenv
-import json
+import orjson
 import asyncio
-
-# Carregar variáveis de ambiente do arquivo .env
-load_dotenv()
+import functools
+import io
+import hashlib
+import logging
+import re
+import tempfile
+import time
+from collections import OrderedDict, deque
+from reprlib import Repr
+
+if TYPE_CHECKING:
+    # Importado sob demanda pelo cache semântico (ver _embed_messages)
+    import numpy as np
+
+# Carregar variáveis de ambiente do arquivo .env (se existir) sem sobrescrever
+# as já definidas no ambiente (em produção/containers a chave vem de lá)
+load_dotenv(override=False)
+
+API_KEY: Final[Optional[str]] = os.getenv("GEMINI_API_KEY")
 
 # ============================================================================
 # INICIALIZAÇÃO DA APLICAÇÃO
 # ============================================================================
 
-app = FastAPI(title="Curriculum Curator Toolkit")
+class ORJSONResponse(JSONResponse):
+    """Resposta JSON serializada com orjson (mais rápido que o json da stdlib)."""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ciclo de vida do servidor: fecha as conexões HTTP do cliente Gemini ao encerrar."""
+    yield
+    if client:
+        await client.aio.aclose()
+    if gemini_http_client:
+        await gemini_http_client.aclose()
+
+
+app = FastAPI(title="Curriculum Curator Toolkit", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Inicializar cliente Gemini
 # IMPORTANTE: A chave da API deve estar no arquivo .env como GEMINI_API_KEY
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
+if not API_KEY:
     print("AVISO: GEMINI_API_KEY não encontrada no ambiente!")
     print("Por favor, crie um arquivo .env com: GEMINI_API_KEY=sua_chave_aqui")
     client = None
+    gemini_http_client = None
 else:
-    client = genai.Client(api_key=api_key)
+    # Um único cliente por processo (e por worker): o pool de conexões HTTP é
+    # reaproveitado entre requisições. O pool é dimensionado explicitamente para
+    # suportar chat + geração em lote simultâneos sem refazer handshakes TCP/TLS.
+    # Com HTTP/2, chamadas concorrentes são multiplexadas na mesma conexão.
+    gemini_http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=200,
+            max_keepalive_connections=100,
+            keepalive_expiry=75  # segundos
+        )
+    )
+    client = genai.Client(
+        api_key=API_KEY,
+        http_options=types.HttpOptions(
+            timeout=120_000,  # ms
+            httpx_async_client=gemini_http_client
+        )
+    )
+
 
 # Servir arquivos estáticos (HTML, CSS, JavaScript)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Em produção, defina SERVE_STATIC=0 e deixe o proxy reverso (nginx/Caddy)
+# servir /static/ direto do disco, liberando o event loop para a API
+if os.getenv("SERVE_STATIC", "1") == "1":
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+GEMINI_MODEL: Final[str] = "gemini-2.5-flash"
+
+# Limite de chamadas simultâneas ao Gemini em todo o processo
+# (evita estourar o limite de requisições por minuto da conta)
+MAX_CONCURRENT_GEMINI: Final[int] = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+gemini_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GEMINI)
+
+# Limite opcional de requisições por minuto (token bucket), para manter o
+# ritmo abaixo da cota da conta em vez de provocar rajadas de 429.
+# 0 desativa; a cota depende do tier da conta no Google AI Studio.
+GEMINI_MAX_RPM: Final[int] = int(os.getenv("GEMINI_MAX_RPM", "0"))
+gemini_rate_limiter = AsyncLimiter(GEMINI_MAX_RPM, 60) if GEMINI_MAX_RPM > 0 else None
+
+
+@asynccontextmanager
+async def gemini_slot():
+    """
+    Reserva uma vaga para uma chamada ao Gemini: aguarda o limite de RPM (se
+    configurado) e mantém uma vaga de gemini_semaphore durante a chamada.
+    """
+    if gemini_rate_limiter is not None:
+        await gemini_rate_limiter.acquire()
+    async with gemini_semaphore:
+        yield
+
+# Retentativas de erros transitórios do Gemini (429/5xx) com backoff exponencial
+# e jitter completo: espera aleatória entre 0 e min(20s, 0.5s * 2^tentativa)
+GEMINI_MAX_ATTEMPTS: Final[int] = 5
+GEMINI_RETRY_WAIT = wait_random_exponential(multiplier=0.5, max=20)
+
+# Tipos de method card aceitos (ver METHOD_CARDS); valores fora desta lista são
+# rejeitados já na validação do Pydantic
+MethodCardType = Literal['video', 'theory', 'case_study', 'practice', 'quiz']
+
+
+class ApiModel(BaseModel):
+    """
+    Base dos modelos da API: rejeita campos desconhecidos, é imutável após a
+    validação e remove espaços nas pontas das strings.
+    """
+    model_config = ConfigDict(extra='forbid', frozen=True, str_strip_whitespace=True)
+
+
+# Estruturas aninhadas vindas do frontend. Como TypedDict (total=False), o
+# pydantic valida os tipos dos campos conhecidos mas entrega dicts comuns,
+# lidos com .get() nas funções de processamento; campos extras são descartados.
+
+@with_config(ConfigDict(extra='ignore'))
+class ResearchSource(TypedDict, total=False):
+    title: str
+    authors: str
+    type: str
+    description: str
+    relevance: str
+
+
+@with_config(ConfigDict(extra='ignore'))
+class CurriculumCard(TypedDict, total=False):
+    id: str
+    title: str
+    description: str
+    order: int
+
+
+@with_config(ConfigDict(extra='ignore'))
+class CurriculumState(TypedDict, total=False):
+    block1: List[CurriculumCard]
+    block2: List[CurriculumCard]
+
 
-GEMINI_MODEL = "gemini-2.5-flash"
+@with_config(ConfigDict(extra='ignore'))
+class ChatMessage(TypedDict, total=False):
+    role: str  # 'user' ou 'assistant'
+    content: str
+    timestamp: str
+    id: str
 
 
-class TopicRequest(BaseModel):
+class TopicRequest(ApiModel):
     topic: str
 
 
-class SubTopicCard(BaseModel):
+class SubTopicCard(ApiModel):
+    # Card do estado do frontend, que pode carregar campos próprios da interface
+    model_config = ConfigDict(extra='ignore')
+    
     id: str
     title: str
     description: str
     order: int
 
 
-class CurriculumRequest(BaseModel):
+class CurriculumRequest(ApiModel):
     topic: str
-    research_sources: List[Dict]
+    research_sources: List[ResearchSource]
     block1: List[SubTopicCard]
     block2: List[SubTopicCard]
+    mode: Optional[Literal['batch']] = None  # 'batch' para gerar via Gemini Batch Mode (assíncrono)
 
 
-class MethodCardRequest(BaseModel):
+class SessionRequest(ApiModel):
     topic: str
+    research_sources: List[ResearchSource] = []
+    curriculum: CurriculumState
+
+
+# Com session_id (POST /api/session), o contexto do subtópico vem da sessão e os
+# campos topic..research_sources podem ser omitidos
+class MethodCardRequest(ApiModel):
     subtopic_id: str
-    subtopic_title: str
-    subtopic_description: str
-    block_id: str
-    previous_subtopics: List[Dict]
-    research_sources: List[Dict]
-    method_card_type: str  # 'video', 'theory', 'case_study', 'practice', 'quiz'
+    method_card_type: MethodCardType
+    session_id: Optional[str] = None
+    topic: Optional[str] = None
+    subtopic_title: Optional[str] = None
+    subtopic_description: Optional[str] = None
+    block_id: Optional[str] = None
+    previous_subtopics: List[CurriculumCard] = []
+    research_sources: List[ResearchSource] = []
 
 
-class MethodCardResponse(BaseModel):
+class MethodCardResponse(ApiModel):
     subtopic_id: str
-    method_card_type: str
+    method_card_type: MethodCardType
     prompt: str
+    error: Optional[str] = None  # Preenchido quando a geração deste card falhou (bulk)
+
+
+class BulkMethodCardRequest(ApiModel):
+    subtopic_id: str
+    session_id: Optional[str] = None
+    topic: Optional[str] = None
+    subtopic_title: Optional[str] = None
+    subtopic_description: Optional[str] = None
+    block_id: Optional[str] = None
+    previous_subtopics: List[CurriculumCard] = []
+    research_sources: List[ResearchSource] = []
+    method_card_types: List[MethodCardType] = ['video', 'theory', 'case_study', 'practice', 'quiz']
+
+
+class AllMethodCardsBatchRequest(ApiModel):
+    topic: str
+    research_sources: List[ResearchSource]
+    block1: List[SubTopicCard]
+    block2: List[SubTopicCard]
+    method_card_types: List[MethodCardType] = ['video', 'theory', 'case_study', 'practice', 'quiz']
 
 
-class ChatbotAction(BaseModel):
-    type: str  # 'add', 'edit', 'remove', 'reorder'
+class ChatbotAction(ApiModel):
+    # Gerado pelo Gemini (saída estruturada): campos extras são ignorados em vez
+    # de invalidar a ação inteira
+    model_config = ConfigDict(extra='ignore')
+    
+    type: Literal['add', 'edit', 'remove', 'reorder']
     blockId: Optional[str] = None  # 'block1' or 'block2' for add/reorder
     cardId: Optional[str] = None  # For edit, remove, reorder
     title: Optional[str] = None  # For add, edit
@@ -109,96 +287,1365 @@ class ChatbotAction(BaseModel):
     cardIds: Optional[List[str]] = None  # For reorder (ordered list of IDs)
 
 
-class ChatbotRequest(BaseModel):
+# Schema da saída estruturada do chatbot: o Gemini gera diretamente um array de ações
+CHATBOT_ACTIONS_SCHEMA = list[ChatbotAction]
+# Validador do array inteiro, construído uma única vez
+_CHATBOT_ACTIONS_ADAPTER = TypeAdapter(CHATBOT_ACTIONS_SCHEMA)
+
+# Schema da saída estruturada das perguntas de feedback
+FEEDBACK_QUESTIONS_SCHEMA = list[str]
+
+
+# Mensagens anteriores do chat que entram no prompt do chatbot
+CHATBOT_HISTORY_LIMIT: Final[int] = 5
+
+
+class ChatbotRequest(ApiModel):
     message: str
     topic: Optional[str] = None
-    research_sources: Optional[List[Dict]] = None
-    curriculum: Dict  # Contains block1 and block2 lists
-    chat_history: Optional[List[Dict]] = None  # Previous messages for context
+    research_sources: Optional[List[ResearchSource]] = None
+    curriculum: CurriculumState
+    chat_history: Optional[List[ChatMessage]] = None  # Previous messages for context
+
+    @field_validator('chat_history')
+    @classmethod
+    def _keep_recent_history(cls, v: Optional[List[ChatMessage]]) -> Optional[List[ChatMessage]]:
+        # Trunca uma única vez na entrada: o prompt e a chave do cache semântico
+        # usam só as últimas mensagens, e o resto não precisa ficar em memória
+        return v[-CHATBOT_HISTORY_LIMIT:] if v else v
 
 
-class ChatbotResponse(BaseModel):
+class ChatbotResponse(ApiModel):
     actions: List[ChatbotAction]
     message: Optional[str] = None  # Optional confirmation/explanation message
     error: Optional[str] = None  # Error message if parsing failed
     feedback_questions: Optional[List[str]] = None  # 3 feedback questions after actions
 
 
+class SubRequest(ApiModel):
+    id: str  # Identificador escolhido pelo cliente, devolvido na resposta
+    method: str = "POST"
+    url: str  # Ex.: '/api/research'
+    body: Optional[Dict] = None
+
+
+class BatchRequest(ApiModel):
+    requests: List[SubRequest]
+
+
+class SubResponse(ApiModel):
+    id: str
+    status: int
+    body: Optional[object] = None
+
+
+class BatchResponse(ApiModel):
+    responses: List[SubResponse]
+
+
 # ============================================================================
 # CONFIGURAÇÃO DOS METHOD CARDS
 # ============================================================================
 # Define os 5 tipos de method cards disponíveis e suas ferramentas associadas
 
-METHOD_CARDS = {
-    'video': {
-        'name': 'Apresentação em Vídeo',
-        'tool': 'inVideo AI',
-        'description': 'Gera prompt para criar vídeo educativo de 60-90 segundos'
-    },
-    'theory': {
-        'name': 'Guia Teórico',
-        'tool': 'NotebookLM',
-        'description': 'Gera prompt para criar guia de estudo analítico'
-    },
-    'case_study': {
-        'name': 'Estudo de Caso (Podcast)',
-        'tool': 'ElevenLabs',
-        'description': 'Gera roteiro de podcast estilo true crime educativo'
-    },
-    'practice': {
-        'name': 'Visualização Interativa',
-        'tool': 'Google Colab',
-        'description': 'Gera código Python para laboratório virtual interativo'
-    },
-    'quiz': {
-        'name': 'Quiz de Diagnóstico',
-        'tool': 'Google Forms',
-        'description': 'Gera questões de múltipla escolha em formato markdown'
-    }
+class MethodCard(NamedTuple):
+    name: str
+    tool: str
+    description: str
+
+
+# Somente leitura: MappingProxyType impede alterações acidentais em tempo de execução
+METHOD_CARDS: Mapping[str, MethodCard] = MappingProxyType({
+    'video': MethodCard(
+        name='Apresentação em Vídeo',
+        tool='inVideo AI',
+        description='Gera prompt para criar vídeo educativo de 60-90 segundos'
+    ),
+    'theory': MethodCard(
+        name='Guia Teórico',
+        tool='NotebookLM',
+        description='Gera prompt para criar guia de estudo analítico'
+    ),
+    'case_study': MethodCard(
+        name='Estudo de Caso (Podcast)',
+        tool='ElevenLabs',
+        description='Gera roteiro de podcast estilo true crime educativo'
+    ),
+    'practice': MethodCard(
+        name='Visualização Interativa',
+        tool='Google Colab',
+        description='Gera código Python para laboratório virtual interativo'
+    ),
+    'quiz': MethodCard(
+        name='Quiz de Diagnóstico',
+        tool='Google Forms',
+        description='Gera questões de múltipla escolha em formato markdown'
+    )
+})
+
+
+# ============================================================================
+# PROMPTS DE SISTEMA
+# ============================================================================
+# Partes estáticas dos prompts, definidas uma única vez na importação do módulo
+# em vez de serem recriadas a cada requisição.
+
+METHOD_CARD_SYSTEM_PROMPTS: Final[Dict[str, str]] = {
+    'video': "Você é um Diretor Criativo de Documentários Científicos e Pedagogo especializado. Crie prompts otimizados para ferramentas de geração de vídeo educacional. Responda sempre em português brasileiro. Retorne APENAS o prompt final, sem explicações adicionais.",
+    'theory': "Você é um especialista em criar prompts otimizados para o NotebookLM. Gere prompts diretos, claros e específicos que o NotebookLM usará para criar conteúdo educacional. O prompt gerado deve ser copiado e colado diretamente no NotebookLM. Responda sempre em português brasileiro. Retorne APENAS o prompt, dirigido ao NotebookLM, sem explicações ou metatexto.",
+    'case_study': "Você é um Roteirista de Podcast Investigativo especializado em conteúdo educacional. Crie roteiros envolventes estilo true crime para ensinar conceitos técnicos. Responda sempre em português brasileiro. Retorne APENAS o roteiro completo, sem explicações adicionais.",
+    'practice': "Você é um Professor Criativo e Engenheiro especializado em Visualizações Científicas Interativas. Crie experiências de aprendizado visualmente envolventes com código Python executável para Google Colab. Seja criativo, didático e inspire curiosidade. Responda sempre em português brasileiro. Retorne APENAS código Python puro, sem blocos markdown (```) e sem texto antes ou depois.",
+    'quiz': "Você é um Professor Universitário exigente, mas didático. Crie questões de múltipla escolha que testem compreensão prática, não memorização. Responda sempre em português brasileiro. Retorne APENAS texto simples (plain text), sem formatação Markdown, sem fórmulas LaTeX, sem símbolos especiais ou caracteres de formatação. Use apenas texto puro (letras, números e pontuação simples), com quebras de linha entre as questões, fácil de ler, copiar e colar no Google Forms.",
+}
+
+# Templates de usuário dos method cards, preenchidos com str.format() a cada
+# chamada: {topic}, {subtopic_title}, {subtopic_description}, {previous_context}
+# e {sources_text}. Versões completas (originais):
+METHOD_CARD_USER_TEMPLATES_VERBOSE: Dict[str, str] = {
+    # Method Card 1: Video Presentation (inVideo AI)
+    'video': """Atue como um Diretor Criativo de Documentários Científicos e Pedagogo.
+Inspire-se em canais como 3blue1brown, Veritasium, Vsauce.
+Escreva um roteiro detalhado para um vídeo curto (60 a 90 segundos) que introduza um novo tópico aos meus alunos.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO DO SUBTÓPICO: {subtopic_description}
+{previous_context}{sources_text}
+
+Sua tarefa é escrever um "Prompt Otimizado" que será usado diretamente na ferramenta "InVideo AI".
+A estrutura narrativa do vídeo deve seguir a lógica da "Curiosidade Investigativa":
+1. **O Gancho (0-10s):** Comece com uma pergunta intrigante ou um fato contraintuitivo do mundo real conectado ao tema. (Misture curiosidade com um leve senso de urgência ou impacto).
+2. **A Ponte (10-40s):** Conecte esse fato à teoria que está sendo estudada, de maneira divertida. Use analogias visuais.
+3. **O Convite (40-90s):** Termine dizendo o que o aluno será capaz de fazer/resolver após dominar essa aula.
+
+SAÍDA ESPERADA:
+Escreva APENAS o prompt em inglês e inclua as configurações abaixo.
+Settings: - Language: Portuguese (Brazil) - Voice: Male and professional - Subtitles: Portuguese (Brazil)
+O prompt deve começar com: "Create a 60-second YouTube Short explaining [TOPIC] with a curious and energetic tone. Target audience: Students."
+
+IMPORTANTE: Retorne APENAS o prompt final, sem explicações adicionais.""",
+    
+    # Method Card 2: Theory Guide (NotebookLM)
+    'theory': """Crie um prompt completo para o NotebookLM que gere um "Guia de Estudo Analítico" sobre o tópico abaixo.
+
+TÓPICO: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+INSTRUÇÕES:
+O prompt que você vai gerar será usado DIRETAMENTE no NotebookLM. O NotebookLM lerá esse prompt e criará um guia de estudo completo para alunos de graduação.
+
+Gere um prompt que instrua o NotebookLM a:
+
+1. Assumir a persona de um Professor Pesquisador e Analista Crítico especializado em {topic}.
+
+2. Criar um Guia de Estudo Analítico completo e estruturado que inclua:
+
+   SEÇÃO 1 - Visão Geral e Relevância Estratégica:
+   - Definir tecnicamente o tópico "{subtopic_title}"
+   - Analisar sua importância estratégica fundamentando-se nas fontes disponíveis
+
+   SEÇÃO 2 - Análise dos Pilares Teóricos:
+   - Identificar e explicar os conceitos-chave (pilares teóricos) que sustentam o tópico
+   - Descrever como esses conceitos se relacionam e dependem uns dos outros
+
+   SEÇÃO 3 - Análise Crítica de Caso de Uso:
+   - Selecionar um caso de uso ou aplicação prática relevante relacionado ao tópico
+   - Analisar o problema que essa aplicação resolveu, o impacto gerado e os desafios enfrentados
+
+   SEÇÃO 4 - Implicações e Desafios:
+   - Discutir limitações, desafios de implementação e implicações técnicas do tópico
+
+   SEÇÃO 5 - Referências Bibliográficas:
+   - Listar todas as fontes utilizadas em formato acadêmico
+   - Usar citações inline numéricas [1], [2], [3] ao longo do texto sempre que informações vierem diretamente das fontes
+
+3. REGRAS IMPORTANTES:
+   - Usar citações inline [1], [2], etc. sempre que citar fontes
+   - Se uma seção não puder ser preenchida por falta de informações nas fontes, escrever o cabeçalho e declarar: "As fontes fornecidas não cobrem este ponto."
+   - Usar linguagem acadêmica, técnica e precisa, adequada para alunos de graduação
+   - O guia deve ser denso em informação e altamente didático
+
+FORMATO DE SAÍDA:
+Retorne APENAS o prompt pronto para ser usado no NotebookLM. O prompt deve começar diretamente com as instruções, como se você estivesse falando com o NotebookLM. Não inclua explicações ou metatexto. O professor vai copiar e colar seu prompt diretamente no NotebookLM.
+
+Exemplo de início do prompt: "Crie um Guia de Estudo Analítico sobre [tópico] seguindo esta estrutura: [...]" """,
+    
+    # Method Card 3: Case Study Podcast
+    'case_study': """Atue como um Roteirista de Podcast Investigativo (estilo "True Crime" ou "Discovery").
+Preciso de um roteiro completo para um episódio curto (3 a 5 minutos) sobre um Estudo de Caso.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+Sua tarefa:
+1. **Encontre um Caso:** Busque um acidente real, falha famosa ou desafio histórico ligado a esse tópico. (Se não houver um caso famoso direto, crie um cenário hipotético ultra-realista em uma indústria).
+2. **Crie os Personagens:**
+    * **Host (Alex):** Curioso, faz as perguntas que o público leigo faria.
+    * **Especialista (Dra. Santos):** Especialista Sênior, explica a falha técnica usando os conceitos da disciplina ({topic}).
+3. **Estrutura do Roteiro:**
+    * **Abertura:** O som do desastre/problema. O contexto.
+    * **A Investigação:** O Host pergunta "O que deu errado?". A Especialista explica os conceitos técnicos envolvidos.
+    * **A Lição:** Como o problema é resolvido ou prevenido hoje.
+
+SAÍDA OBRIGATÓRIA:
+Escreva o roteiro em formato de diálogo teatral.
+Inclua "Marcadores de Emoção" entre parênteses para guiar a IA de voz (ex: [Tom sério], [Surpreso], [Didático]).
+
+IMPORTANTE: Retorne APENAS o roteiro completo, sem explicações adicionais.""",
+    
+    # Method Card 4: Practice Visualization (Google Colab)
+    'practice': """**Contexto:**
+Você é um Professor Criativo especializado em criar experiências de aprendizado visualmente envolventes para a disciplina {topic}.
+Sua missão é criar um laboratório virtual interativo ou visualização didática no Google Colab que ajude os alunos a compreenderem profundamente o conceito.
+
+**Tópico da Aula:** {subtopic_title}
+**Descrição:** {subtopic_description}
+{previous_context}{sources_text}
+
+**Sua Tarefa:**
+Crie um código Python completo, executável e didático que demonstre visualmente o conceito estudado. Seja criativo e pense em formas interessantes de visualizar o fenômeno ou conceito - pode ser através de:
+- Gráficos interativos e animações
+- Simulações visuais
+- Visualizações comparativas
+- Aplicações interativas simples
+- Demonstrações práticas do conceito em ação
+
+**Orientações de Design:**
+1. **Criatividade Visual:** Pense em formas engenhosas e claras de mostrar o conceito. Use analogias visuais, animações, ou múltiplas perspectivas quando apropriado.
+2. **Didática:** Inclua comentários explicativos no código que ajudem o aluno a entender o que está acontecendo. Explique o "porquê", não apenas o "como".
+3. **Bibliotecas Flexíveis:** Use as bibliotecas que fizerem mais sentido para a visualização (matplotlib, plotly, numpy, pandas, etc.). Não há obrigatoriedade de usar widgets ou sliders - o importante é que a visualização seja clara e educativa.
+4. **Completude:** O código deve ser executável diretamente em uma célula do Google Colab, incluindo imports necessários.
+5. **Interpretação:** Adicione comentários ou prints que expliquem o que a visualização mostra e como ela ajuda a entender o conceito.
+6. **Robustez:** Trate erros matemáticos ou de entrada quando apropriado.
+
+**Formato de Saída:**
+Retorne APENAS o código Python puro, diretamente, sem blocos markdown, sem explicações antes ou depois, sem ```python``` ou formatação markdown. Apenas o código executável que pode ser copiado e colado diretamente em uma célula do Colab.""",
+    
+    # Method Card 5: Quiz Questions
+    'quiz': """Atue como um Professor Universitário exigente, mas didático.
+Com base no conteúdo abaixo, crie um "Quiz de Diagnóstico" com 4 questões de múltipla escolha.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+REGRAS DE OURO PARA AS QUESTÕES:
+1. Proibido Decorar: Não faça perguntas de definição (ex: "O que é X?").
+2. Foco em Cenário: Crie situações-problema. Use frases como "Se a variável X dobrar...", "Em um cenário onde...", "Um profissional observou que...".
+3. Distratores Inteligentes: As alternativas erradas não devem ser absurdas. Elas devem representar erros comuns de conceito que os alunos costumam cometer.
+4. Aplicação Prática: Cada questão deve testar a capacidade de aplicar o conceito em uma situação real.
+
+FORMATO DE SAÍDA (texto simples, sem Markdown):
+Para cada questão, use este formato exato:
+
+Questão 1:
+[Enunciado com cenário prático, em texto simples, sem símbolos especiais ou formatação]
+
+A) [Alternativa A - texto simples]
+B) [Alternativa B - texto simples]
+C) [Alternativa C - texto simples]
+D) [Alternativa D - texto simples]
+
+Questão 2:
+[Enunciado...]
+
+A) [Alternativa A]
+B) [Alternativa B]
+C) [Alternativa C]
+D) [Alternativa D]
+
+[Continue para Questão 3 e Questão 4 no mesmo formato]
+
+GABARITO:
+Questão 1: [Letra correta: A, B, C ou D]
+Questão 2: [Letra correta: A, B, C ou D]
+Questão 3: [Letra correta: A, B, C ou D]
+Questão 4: [Letra correta: A, B, C ou D]
+
+EXPLICAÇÕES:
+Questão 1: [Explicação da resposta correta e por que as outras estão erradas - texto simples, sem formatação]
+Questão 2: [Explicação - texto simples]
+Questão 3: [Explicação - texto simples]
+Questão 4: [Explicação - texto simples]
+
+REGRAS CRÍTICAS DE FORMATAÇÃO:
+- Use APENAS texto simples (plain text)
+- NÃO use Markdown (sem asteriscos, sem negrito, sem itálico, sem listas formatadas)
+- NÃO use fórmulas LaTeX (sem símbolos matemáticos especiais, escreva por extenso ou use notação simples)
+- NÃO use símbolos especiais ou caracteres de formatação
+- Use apenas letras, números, vírgulas, pontos, dois pontos e parênteses
+- Use quebras de linha simples para separar questões
+- Texto deve ser fácil de copiar e colar diretamente no Google Forms"""
 }
 
+# Versões compactas (padrão): mesmas exigências com ~50% menos texto, pois as
+# personas e as regras de saída já estão em METHOD_CARD_SYSTEM_PROMPTS
+METHOD_CARD_USER_TEMPLATES_COMPACT: Dict[str, str] = {
+    'video': """Prompt em inglês para o InVideo AI gerar um vídeo de 60-90s (estilo 3blue1brown/Veritasium) que apresente a aula.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+Estrutura: Gancho (0-10s, pergunta ou fato contraintuitivo real); Ponte (10-40s, fato → teoria com analogias visuais); Convite (40-90s, o que o aluno fará após a aula).
+
+Comece com: "Create a 60-second YouTube Short explaining [TOPIC] with a curious and energetic tone. Target audience: Students."
+Inclua: Settings: - Language: Portuguese (Brazil) - Voice: Male and professional - Subtitles: Portuguese (Brazil)""",
+    
+    'theory': """Escreva um prompt para o NotebookLM criar um "Guia de Estudo Analítico" para alunos de graduação.
+
+TÓPICO: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+O prompt deve pedir que o NotebookLM, como Professor Pesquisador e Analista Crítico em {topic}, escreva:
+1. Visão Geral e Relevância Estratégica: definição técnica de "{subtopic_title}" e sua importância, com base nas fontes.
+2. Pilares Teóricos: conceitos-chave e como se relacionam.
+3. Análise Crítica de Caso de Uso: problema resolvido, impacto e desafios de uma aplicação real.
+4. Implicações e Desafios: limitações e desafios de implementação.
+5. Referências Bibliográficas em formato acadêmico.
+Regras: citações inline [1], [2]... sempre que usar as fontes; seção sem cobertura nas fontes mantém o cabeçalho e declara "As fontes fornecidas não cobrem este ponto."; linguagem acadêmica, densa e didática.
+
+Comece o prompt com "Crie um Guia de Estudo Analítico sobre..." """,
+    
+    'case_study': """Roteiro de podcast (3-5 min) sobre um Estudo de Caso.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+Caso: falha famosa, acidente ou desafio histórico real ligado ao tópico (ou cenário realista de indústria).
+Alex (host curioso, perguntas de leigo) e Dra. Santos (explica a falha com os conceitos de {topic}).
+Abertura (o problema) → Investigação ("O que deu errado?") → Lição (como se previne hoje).
+Diálogo teatral com marcadores de emoção: [Tom sério], [Surpreso], [Didático].""",
+    
+    'practice': """Crie um laboratório virtual ou visualização didática em Python para o Google Colab sobre o tópico abaixo, da disciplina {topic}.
+
+Tópico da Aula: {subtopic_title}
+Descrição: {subtopic_description}
+{previous_context}{sources_text}
+
+- Visualize o conceito de forma criativa e clara (gráficos interativos, animações, simulações, comparações ou pequenas aplicações), com analogias visuais quando útil.
+- Comente o código explicando o porquê, não só o como, e inclua prints que interpretem o resultado.
+- Use as bibliotecas mais adequadas (matplotlib, plotly, numpy, pandas...); widgets são opcionais.
+- Código completo, com imports, executável em uma única célula e tratando erros matemáticos ou de entrada quando apropriado.""",
+    
+    'quiz': """Crie um "Quiz de Diagnóstico" com 4 questões de múltipla escolha.
+
+TÓPICO DA AULA: {subtopic_title}
+CONTEXTO DO CURSO: {topic}
+DESCRIÇÃO: {subtopic_description}
+{previous_context}{sources_text}
+
+Regras:
+1. Nada de definições ("O que é X?"): use cenários e situações-problema ("Se a variável X dobrar...", "Um profissional observou que...").
+2. Cada questão testa a aplicação do conceito em uma situação real.
+3. Distratores plausíveis, baseados em erros conceituais comuns.
+
+Formato:
+Questão 1:
+[Enunciado]
+
+A) [Alternativa]
+B) [Alternativa]
+C) [Alternativa]
+D) [Alternativa]
+
+(Questões 2 a 4 no mesmo formato)
+
+GABARITO:
+Questão 1: [Letra]
+(uma linha por questão)
+
+EXPLICAÇÕES:
+Questão 1: [Por que a resposta está correta e as outras estão erradas]
+(uma linha por questão)"""
+}
+
+# PROMPT_VERBOSE=1 volta aos templates completos (comparação A/B)
+PROMPT_VERBOSE: Final[bool] = os.getenv("PROMPT_VERBOSE") == "1"
+METHOD_CARD_USER_TEMPLATES: Dict[str, str] = (
+    METHOD_CARD_USER_TEMPLATES_VERBOSE if PROMPT_VERBOSE else METHOD_CARD_USER_TEMPLATES_COMPACT
+)
+
+RESEARCH_SYSTEM_PROMPT: Final[str] = "Você é um pesquisador acadêmico especialista. Forneça recomendações de fontes de pesquisa precisas e bem estruturadas. Responda sempre em português brasileiro."
+
+CURRICULUM_SYSTEM_PROMPT: Final[str] = "Você é um especialista em design curricular baseado em competências. Crie habilidades progressivas e práticas que se constroem umas sobre as outras, focando em competências mensuráveis e aplicáveis. Responda sempre em português brasileiro."
+
+# Instruções do chatbot: constante para que o prefixo enviado ao Gemini seja
+# byte a byte o mesmo em todas as chamadas (condição para o cache de prefixo)
+CHATBOT_SYSTEM_PROMPT: Final[str] = """Você é um assistente criativo e inteligente especializado em gerenciar currículos educacionais. 
+Sua tarefa é interpretar comandos em linguagem natural e convertê-los em ações estruturadas.
+
+IMPORTANTE: Seja CRIATIVO e FLEXÍVEL. Você tem autoridade para:
+- Criar múltiplos cards de uma vez quando solicitado
+- Inferir títulos e descrições quando o usuário fornecer apenas um tópico geral
+- Dividir tópicos amplos em múltiplos cards específicos
+- Usar seu conhecimento educacional para criar descrições relevantes
+- Ser proativo: se o usuário pedir "5 cards sobre X", crie 5 cards diferentes e relevantes sobre aspectos de X
+- ORDENAR LOGICAMENTE: quando criar múltiplos cards, coloque os mais básicos/introdutórios PRIMEIRO (sem position, serão adicionados sequencialmente) e os mais avançados DEPOIS
+- PROGRESSÃO PEDAGÓGICA: organize os cards em ordem crescente de complexidade, do mais fundamental ao mais avançado
+
+Estrutura do currículo:
+- Existem dois blocos: "block1" (Fundamentos) e "block2" (Aplicações Práticas)
+- Cada card tem: id (string), title (string), description (string), order (int)
+- A lista é ordenada: ordem 0 = PRIMEIRO/INÍCIO/TOPO, ordem maior = ÚLTIMO/FIM/FINAL
+
+IMPORTANTE SOBRE POSICIONAMENTO:
+- "Primeiro", "início", "topo", "começo" = ordem 0 (primeira posição)
+- "Último", "fim", "final", "final da lista" = maior ordem (última posição)
+- Quando adicionar um card SEM especificar posição, adicione ao FINAL (não inclua "position")
+- Quando adicionar "no início" ou "no começo", use position: 0
+- Quando adicionar "no final" ou "no fim", NÃO inclua "position" (será adicionado automaticamente ao final)
+
+Tipos de ações disponíveis:
+1. ADD: Adicionar novo card
+   {"type": "add", "blockId": "block1" ou "block2", "title": "título", "description": "descrição", "position": número opcional}
+   - Se não especificar posição, NÃO inclua o campo "position" (será adicionado ao final)
+   - Se especificar "no início" ou "primeiro", use "position": 0
+   - Se especificar "no final" ou "último", NÃO inclua "position"
+
+2. EDIT: Editar card existente
+   {"type": "edit", "cardId": "id-do-card", "title": "novo título" (opcional), "description": "nova descrição" (opcional)}
+
+3. REMOVE: Remover card
+   {"type": "remove", "cardId": "id-do-card"}
+
+4. REORDER: Reordenar cards em um bloco
+   {"type": "reorder", "blockId": "block1" ou "block2", "cardIds": ["id1", "id2", "id3", ...]}
+   - O array cardIds deve conter TODOS os IDs do bloco na ordem desejada
+   - Primeiro ID no array = primeiro na lista (ordem 0)
+   - Último ID no array = último na lista (maior ordem)
+
+REGRAS CRÍTICAS:
+- Use os IDs exatos dos cards quando referenciar cards existentes
+- Para reordenar, forneça TODOS os IDs do bloco na ordem desejada
+- Seja preciso: use os IDs exatos do currículo fornecido
+- Seja CRIATIVO: quando o usuário pedir múltiplos cards, crie múltiplas ações ADD
+- Seja INTELIGENTE: se o usuário pedir "5 cards sobre Python", crie 5 cards diferentes sobre aspectos relevantes de Python
+- Seja PROATIVO: se faltar informação, use seu conhecimento para criar títulos e descrições relevantes
+- ORDENE LOGICAMENTE: quando criar múltiplos cards, coloque-os no array na ordem pedagógica correta - básico/fundamental PRIMEIRO, avançado DEPOIS
+- PROGRESSÃO: o primeiro card no array será o primeiro visualmente (mais básico), o último será o último (mais avançado)
+- NÃO retorne array vazio [] a menos que seja realmente impossível interpretar o comando
+- Responda sempre em português brasileiro quando necessário explicar algo
+
+Exemplos:
+Comando: "Adicione um card sobre 'Introdução a Python' no bloco 1"
+Resposta: [{"type": "add", "blockId": "block1", "title": "Introdução a Python", "description": "Conceitos básicos da linguagem Python"}]
+(Não inclui "position" - será adicionado ao final)
+
+Comando: "Crie 5 cards sobre Python no bloco 1"
+Resposta: [
+  {"type": "add", "blockId": "block1", "title": "Sintaxe Básica do Python", "description": "Aprendendo a estrutura fundamental da linguagem Python"},
+  {"type": "add", "blockId": "block1", "title": "Tipos de Dados e Variáveis", "description": "Compreendendo os tipos primitivos e como declarar variáveis"},
+  {"type": "add", "blockId": "block1", "title": "Estruturas de Controle", "description": "Condicionais (if/else) e loops (for/while) em Python"},
+  {"type": "add", "blockId": "block1", "title": "Estruturas de Dados", "description": "Listas, dicionários, tuplas e sets em Python"},
+  {"type": "add", "blockId": "block1", "title": "Funções e Módulos", "description": "Criando e organizando código com funções e módulos"}
+]
+NOTA: Os cards são adicionados na ordem do array - o primeiro será o primeiro na lista (mais básico), o último será o último (mais avançado). Sempre ordene do mais fundamental ao mais complexo.
+
+Comando: "Adicione 3 cards sobre machine learning no bloco 2"
+Resposta: [
+  {"type": "add", "blockId": "block2", "title": "Introdução ao Machine Learning", "description": "Conceitos fundamentais e tipos de aprendizado"},
+  {"type": "add", "blockId": "block2", "title": "Algoritmos de Classificação", "description": "Regressão logística, árvores de decisão e SVM"},
+  {"type": "add", "blockId": "block2", "title": "Validação e Métricas", "description": "Técnicas de validação cruzada e métricas de avaliação"}
+]
+NOTA: Sempre ordene do mais básico (primeiro no array) ao mais avançado (último no array). O primeiro card do array será o primeiro na lista visual.
+
+Comando: "Adicione um card sobre 'Pré-requisitos' no início do bloco 1"
+Resposta: [{"type": "add", "blockId": "block1", "title": "Pré-requisitos", "description": "...", "position": 0}]
+
+Comando: "Mova o primeiro card do bloco 1 para o final"
+Resposta: [{"type": "reorder", "blockId": "block1", "cardIds": ["block1-1", "block1-2", "block1-0"]}]
+(block1-0 era o primeiro, agora é o último no array)
+
+Comando: "Mova o último card para o início"
+Resposta: [{"type": "reorder", "blockId": "block1", "cardIds": ["block1-2", "block1-0", "block1-1"]}]
+(block1-2 era o último, agora é o primeiro no array)
+
+Comando: "Edite o card block1-0 para ter o título 'Novo Título'"
+Resposta: [{"type": "edit", "cardId": "block1-0", "title": "Novo Título"}]
+
+Comando: "Remova o card sobre X"
+Resposta: [{"type": "remove", "cardId": "block1-2"}]"""
+
+FEEDBACK_SYSTEM_PROMPT: Final[str] = """Você é um assistente educacional que ajuda professores a refinar seus currículos.
+Após executar mudanças no currículo, você deve gerar 3 perguntas de feedback relevantes e úteis.
+
+As perguntas devem:
+- Ser específicas ao contexto das ações executadas
+- Ajudar o professor a pensar em melhorias ou ajustes
+- Ser curtas e diretas
+- Ser em português brasileiro
+- Variar entre: verificação de satisfação, sugestões de melhoria, e necessidades adicionais"""
+
+# Perguntas prontas para os casos mais comuns (todas as ações do mesmo tipo),
+# chaveadas por (tipo da ação, quantidade de ações): dispensam esperar a
+# geração pelo Gemini
+_FEEDBACK_TEMPLATES: Dict[Tuple[str, int], List[str]] = {
+    ('add', 1): [
+        "O novo card está na posição certa da sequência?",
+        "O título e a descrição do card refletem o que você quer ensinar?",
+        "Falta algum pré-requisito para este novo conteúdo?"
+    ],
+    ('add', 2): [
+        "Os novos cards estão na ordem certa entre si e em relação aos demais?",
+        "Os conteúdos adicionados se sobrepõem a algum card existente?",
+        "Deseja ajustar o título ou a descrição de algum dos novos cards?"
+    ],
+    ('edit', 1): [
+        "A nova versão do card ficou clara para os alunos?",
+        "A alteração afeta algum card que depende deste conteúdo?",
+        "Deseja revisar outros cards com o mesmo nível de detalhe?"
+    ],
+    ('edit', 2): [
+        "As edições deixaram os cards mais claros e consistentes?",
+        "As mudanças exigem ajustes nos cards vizinhos?",
+        "Há outros cards que precisam da mesma revisão?"
+    ],
+    ('remove', 1): [
+        "O conteúdo removido era pré-requisito de algum outro card?",
+        "Deseja substituir o card removido por outro conteúdo?",
+        "A sequência do bloco continua coerente sem este card?"
+    ],
+    ('remove', 2): [
+        "Os cards removidos deixaram alguma lacuna no currículo?",
+        "Deseja adicionar conteúdos para cobrir o que foi retirado?",
+        "O currículo ficou com a carga adequada após as remoções?"
+    ],
+    ('reorder', 1): [
+        "A nova ordem respeita os pré-requisitos entre os cards?",
+        "A progressão de dificuldade ficou adequada para os alunos?",
+        "Deseja reorganizar também o outro bloco?"
+    ],
+}
+
+
+# ============================================================================
+# CACHE DE RESPOSTAS DO GEMINI
+# ============================================================================
+# Pesquisas, currículos e method cards se repetem com frequência entre usuários
+# (mesmo tópico, mesmo tipo de card). Respostas idênticas são servidas da
+# memória por RESPONSE_CACHE_TTL segundos, evitando uma nova chamada ao Gemini.
+# Pesquisa e currículo usam chaves por tópico normalizado (_topic_cache_key).
+# Chamadas sensíveis a variação (ex.: chatbot) não usam o cache.
+
+RESPONSE_CACHE_TTL: Final[int] = 3600  # segundos
+RESPONSE_CACHE_MAX_ENTRIES: Final[int] = 512
+
+_response_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+
+def _response_cache_key(system_prompt: str, user_prompt: str, model: str) -> str:
+    """Gera a chave do cache de respostas a partir dos prompts e do modelo."""
+    raw = f"{system_prompt}\x00{user_prompt}\x00{model}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _topic_cache_key(kind: str, topic: str, *extra: str) -> str:
+    """
+    Gera uma chave do cache de respostas por tópico normalizado, para que
+    "Física Quântica" e " física  quântica" compartilhem a mesma resposta.
+    
+    Args:
+        kind: Tipo da geração (ex.: 'research', 'subtopics')
+        topic: Tópico informado pelo usuário
+        extra: Demais partes que distinguem a geração (ex.: títulos das fontes)
+    """
+    normalized = " ".join(topic.split()).casefold()
+    return _response_cache_key(kind, "\x00".join((normalized, *extra)), GEMINI_MODEL)
+
+
+def _response_cache_get(key: str) -> Optional[str]:
+    """Retorna a resposta em cache se ainda estiver dentro do TTL."""
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    timestamp, text = entry
+    if time.time() - timestamp >= RESPONSE_CACHE_TTL:
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return text
+
+
+def _response_cache_put(key: str, text: str) -> None:
+    """Armazena uma resposta no cache, descartando a menos usada se estiver cheio."""
+    _response_cache[key] = (time.time(), text)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+
+# ============================================================================
+# SESSÕES DO CURSO
+# ============================================================================
+# O frontend registra uma vez o tópico, as fontes e o currículo (POST /api/session)
+# e as gerações de method cards passam a enviar apenas session_id + subtopic_id,
+# em vez de reenviar o mesmo contexto em cada uma das dezenas de chamadas. O id é
+# o hash do conteúdo: o mesmo estado gera sempre a mesma sessão.
+# As sessões são gravadas em SESSION_DIR, compartilhado pelos workers do gunicorn
+# (a requisição do method card pode chegar a outro processo que não o que
+# registrou a sessão); cada worker mantém as lidas num LRU em memória. Com vários
+# hosts, SESSION_DIR deve ser um volume compartilhado.
+
+SESSION_TTL: Final[int] = 6 * 3600  # segundos
+SESSION_MAX_ENTRIES: Final[int] = 1024  # por worker, em memória
+SESSION_DIR: Final[str] = os.getenv(
+    "SESSION_DIR", os.path.join(tempfile.gettempdir(), "curriculum-curator-sessions")
+)
+_SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class CourseSession(NamedTuple):
+    topic: str
+    research_sources: List[Dict]
+    curriculum: Dict
+
+
+class SubtopicContext(NamedTuple):
+    """Argumentos de generate_method_card_prompt() que descrevem o subtópico."""
+    topic: str
+    subtopic_title: str
+    subtopic_description: str
+    previous_subtopics: List[Dict]
+    research_sources: List[Dict]
+
+
+_sessions: "OrderedDict[str, Tuple[float, CourseSession]]" = OrderedDict()
+
+
+def _session_memory_put(session_id: str, timestamp: float, session: CourseSession) -> None:
+    """Guarda a sessão no LRU do worker, descartando a menos usada se estiver cheio."""
+    _sessions[session_id] = (timestamp, session)
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > SESSION_MAX_ENTRIES:
+        _sessions.popitem(last=False)
+
+
+def _session_path(session_id: str) -> str:
+    return os.path.join(SESSION_DIR, f"{session_id}.json")
+
+
+def _session_write(session_id: str, data: bytes) -> None:
+    """Grava a sessão em SESSION_DIR (escrita atômica) e remove os arquivos expirados."""
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    path = _session_path(session_id)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)  # regravar o mesmo conteúdo renova o TTL (mtime)
+    
+    now = time.time()
+    with os.scandir(SESSION_DIR) as entries:
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime >= SESSION_TTL:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Removido por outro worker
+
+
+def _session_read(session_id: str) -> Optional[Tuple[float, CourseSession]]:
+    """Lê a sessão de SESSION_DIR; retorna (gravada em, sessão) ou None se não existir ou expirou."""
+    path = _session_path(session_id)
+    try:
+        timestamp = os.stat(path).st_mtime
+        if time.time() - timestamp >= SESSION_TTL:
+            return None
+        with open(path, "rb") as f:
+            return timestamp, CourseSession(**orjson.loads(f.read()))
+    except (FileNotFoundError, orjson.JSONDecodeError, TypeError):
+        return None
+
+
+async def _session_put(session: CourseSession) -> str:
+    """Armazena a sessão (renovando o TTL) e retorna seu id."""
+    data = orjson.dumps(session._asdict())
+    session_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+    _session_memory_put(session_id, time.time(), session)
+    try:
+        await asyncio.to_thread(_session_write, session_id, data)
+    except OSError as e:
+        # Sem o arquivo a sessão só vale neste worker; os demais respondem 404
+        logger.warning("Não foi possível gravar a sessão em %s: %s", SESSION_DIR, e)
+    return session_id
+
+
+async def _session_get(session_id: str) -> Optional[CourseSession]:
+    """Retorna a sessão (do LRU do worker ou de SESSION_DIR) se ainda estiver dentro do TTL."""
+    if not _SESSION_ID_PATTERN.fullmatch(session_id):
+        return None  # Também impede que o id vire um caminho fora de SESSION_DIR
+    
+    entry = _sessions.get(session_id)
+    if entry is None:
+        entry = await asyncio.to_thread(_session_read, session_id)
+        if entry is None:
+            return None
+        _session_memory_put(session_id, *entry)
+        return entry[1]
+    
+    timestamp, session = entry
+    if time.time() - timestamp >= SESSION_TTL:
+        del _sessions[session_id]
+        return None
+    _sessions.move_to_end(session_id)
+    return session
+
+
+async def resolve_subtopic_context(request: Union[MethodCardRequest, BulkMethodCardRequest]) -> SubtopicContext:
+    """
+    Obtém o contexto do subtópico de uma requisição de method card: da sessão,
+    se houver session_id, ou dos campos enviados na própria requisição.
+    
+    Pré-requisitos vindos da sessão são os subtópicos anteriores do mesmo bloco.
+    
+    Raises:
+        HTTPException: 404 se a sessão ou o subtópico não existirem, 400 se
+            faltarem campos sem sessão
+    """
+    if request.session_id is None:
+        if request.topic is None or request.subtopic_title is None:
+            raise HTTPException(status_code=400, detail="Informe session_id ou topic e subtopic_title")
+        return SubtopicContext(
+            request.topic,
+            request.subtopic_title,
+            request.subtopic_description or "",
+            request.previous_subtopics,
+            request.research_sources
+        )
+    
+    session = await _session_get(request.session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada")
+    
+    for block in session.curriculum.values():
+        for index, card in enumerate(block):
+            if card.get("id") == request.subtopic_id:
+                return SubtopicContext(
+                    session.topic,
+                    card.get("title", ""),
+                    card.get("description", ""),
+                    block[:index],
+                    session.research_sources
+                )
+    raise HTTPException(status_code=404, detail=f"Subtópico não encontrado na sessão: {request.subtopic_id}")
+
+
+# ============================================================================
+# CONTEXT CACHING DO GEMINI (PREFIXO ESTÁVEL)
+# ============================================================================
+# Prompts longos cujo início se repete entre chamadas (ex.: instruções do chatbot)
+# podem ter esse prefixo (o system prompt) registrado no Gemini via
+# caches.create. As chamadas seguintes enviam só a parte variável e referenciam o
+# cache, pagando ~10% do custo dos tokens de entrada em cache e com menor TTFT.
+
+CONTEXT_CACHE_TTL: Final[int] = 600  # segundos
+CONTEXT_CACHE_MIN_CHARS: Final[int] = 4096  # ~1024 tokens, mínimo aceito pelo Gemini para cache explícito
+# Um cache usado nos últimos segundos antes de expirar tem o TTL estendido em
+# segundo plano (caches.update), para que a próxima chamada não espere por um
+# caches.create. Caches sem uso simplesmente expiram (nenhum worker os mantém
+# vivos sem tráfego).
+CONTEXT_CACHE_REFRESH_AHEAD: Final[int] = 120  # segundos
+
+# hash(modelo + prefixo) -> (expira_em, criação/renovação do CachedContent, que
+# resulta no nome ou em None se o prefixo não for cacheável). Entradas cuja
+# criação falhou são removidas (ver _forget_failed_context_cache).
+_context_caches: Dict[str, Tuple[float, "asyncio.Task[Optional[str]]"]] = {}
+# hash(modelo + prefixo) -> renovação de TTL em andamento
+_context_cache_refreshes: Dict[str, "asyncio.Task[Optional[str]]"] = {}
+
+
+async def _create_context_cache(prefix: str, model: str) -> Optional[str]:
+    """
+    Registra o prefixo no Gemini e retorna o nome do cache.
+    
+    Retorna None se o Gemini recusar o prefixo (400, ex.: abaixo do mínimo de
+    tokens); erros transitórios (429, 5xx, rede) são propagados.
+    """
+    try:
+        cached = await client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(system_instruction=prefix, ttl=f"{CONTEXT_CACHE_TTL}s")
+        )
+    except errors.ClientError as e:
+        if e.code != 400:
+            raise
+        return None
+    return cached.name
+
+
+async def _extend_context_cache(name: str) -> Optional[str]:
+    """Estende o TTL de um cache existente no Gemini e retorna seu nome."""
+    await client.aio.caches.update(
+        name=name,
+        config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL}s")
+    )
+    return name
+
+
+def _forget_failed_context_cache(key: str, task: "asyncio.Task[Optional[str]]") -> None:
+    """Remove a entrada cuja criação falhou, para que a próxima chamada tente de novo."""
+    if task.cancelled() or task.exception() is not None:
+        entry = _context_caches.get(key)
+        if entry is not None and entry[1] is task:
+            del _context_caches[key]
+
+
+async def _get_context_cache(prefix: str, model: str) -> Optional[str]:
+    """
+    Retorna o nome do CachedContent do prefixo, criando-o no Gemini se necessário.
+    
+    Retorna None quando o prefixo é curto demais, o Gemini recusa o cache ou a
+    criação falha; nesse caso a chamada deve enviar o prompt completo.
+    """
+    if len(prefix) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+    
+    key = hashlib.sha256(f"{model}\x00{prefix}".encode("utf-8")).hexdigest()
+    now = time.time()
+    entry = _context_caches.get(key)
+    if entry is None or entry[0] <= now:
+        # Remover entradas expiradas e registrar a criação ANTES de aguardá-la:
+        # chamadas concorrentes com o mesmo prefixo (ex.: os cards de um mesmo
+        # subtópico no bulk) aguardam a mesma criação em vez de cada uma criar
+        # (e pagar) seu próprio cache. Margem de 30s antes do TTL real.
+        for expired_key in [k for k, (expires_at, _) in _context_caches.items() if expires_at <= now]:
+            del _context_caches[expired_key]
+        # Uma renovação em andamento estende o mesmo cache: aguardá-la em vez de criar outro
+        task = _context_cache_refreshes.get(key) or asyncio.ensure_future(_create_context_cache(prefix, model))
+        task.add_done_callback(functools.partial(_forget_failed_context_cache, key))
+        entry = (now + CONTEXT_CACHE_TTL - 30, task)
+        _context_caches[key] = entry
+    elif entry[0] - now < CONTEXT_CACHE_REFRESH_AHEAD and key not in _context_cache_refreshes:
+        task = entry[1]
+        if task.done() and not task.cancelled() and task.exception() is None and task.result() is not None:
+            _refresh_context_cache(key, task.result())
+    
+    try:
+        # shield: o cancelamento de uma requisição não cancela a criação compartilhada
+        return await asyncio.shield(entry[1])
+    except Exception:
+        # Falha transitória: a entrada já foi removida e a próxima chamada tenta de novo
+        return None
+
+
+def _refresh_context_cache(key: str, name: str) -> None:
+    """
+    Estende em segundo plano o TTL de um cache prestes a expirar.
+    
+    As chamadas seguem usando o cache enquanto a renovação não termina; se ela
+    falhar (ex.: o cache já expirou no Gemini), a entrada é removida e a
+    próxima chamada cria outro.
+    """
+    started_at = time.time()
+    task = asyncio.ensure_future(_extend_context_cache(name))
+    _context_cache_refreshes[key] = task
+    
+    def extended(done: "asyncio.Task[Optional[str]]") -> None:
+        _context_cache_refreshes.pop(key, None)
+        if done.cancelled() or done.exception() is not None:
+            _context_caches.pop(key, None)
+        else:
+            _context_caches[key] = (started_at + CONTEXT_CACHE_TTL - 30, done)
+    
+    task.add_done_callback(extended)
+
+
+# ============================================================================
+# CACHE SEMÂNTICO DO CHATBOT
+# ============================================================================
+# Comandos do chatbot costumam se repetir com outra redação ("remova o card X" /
+# "apague o card X"). Uma mensagem idêntica (após normalizar espaços e
+# maiúsculas) feita sobre o MESMO contexto (currículo, fontes e histórico
+# idênticos) reaproveita a resposta anterior. Senão, as mensagens anteriores do
+# contexto com a mesma assinatura (_command_signature: palavras de conteúdo,
+# números, IDs e termos citados, com verbos sinônimos unificados) são candidatas:
+# só então a mensagem e as candidatas são convertidas em embedding (uma chamada)
+# e comparadas (cosseno) — acima de SEMANTIC_CACHE_THRESHOLD, a resposta é
+# reaproveitada. Sem candidatas (o caso comum) nenhum embedding é calculado. A
+# busca corre em paralelo com a geração, que só é cancelada se ela chegar antes
+# e encontrar uma mensagem equivalente (um acerto nunca atrasa um erro de cache).
+
+SEMANTIC_CACHE_MODEL: Final[str] = "gemini-embedding-001"
+SEMANTIC_CACHE_DIM: Final[int] = 768
+SEMANTIC_CACHE_THRESHOLD: Final[float] = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES: Final[int] = 1024
+
+# (hash do contexto, mensagem normalizada, assinatura do comando, resposta JSON do Gemini)
+_semantic_cache: "deque[Tuple[str, str, Tuple[str, ...], str]]" = deque(maxlen=SEMANTIC_CACHE_MAX_ENTRIES)
+# mensagem normalizada -> embedding normalizado (calculado só quando há candidatas)
+_message_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+# Termos citados entre aspas ficam inteiros; o resto é quebrado em palavras/IDs
+_COMMAND_TOKEN_PATTERN = re.compile(r'"[^"]*"|“[^”]*”|[\w-]+')
+# Palavras que não mudam o comando
+_COMMAND_STOPWORDS: Final[frozenset] = frozenset((
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das",
+    "em", "no", "na", "nos", "nas", "ao", "aos", "à", "às", "para", "pra", "por",
+    "pelo", "pela", "com", "e", "que", "favor", "card", "cards", "cartão", "cartões"
+))
+# Verbos sinônimos -> ação; verbos de ações diferentes nunca coincidem
+_COMMAND_SYNONYMS: Final[Mapping[str, str]] = MappingProxyType({
+    **dict.fromkeys((
+        "adicione", "adicionar", "adiciona", "acrescente", "acrescentar",
+        "crie", "criar", "inclua", "incluir", "insira", "inserir"
+    ), "add"),
+    **dict.fromkeys((
+        "remova", "remover", "remove", "apague", "apagar", "exclua", "excluir",
+        "delete", "deletar", "tire", "tirar"
+    ), "remove"),
+    **dict.fromkeys(("mova", "mover", "move", "transfira", "transferir"), "move"),
+    **dict.fromkeys((
+        "edite", "editar", "altere", "alterar", "renomeie", "renomear", "atualize", "atualizar"
+    ), "edit"),
+})
+
+
+def _semantic_context_key(context: str, chat_history: Optional[List[Dict]]) -> str:
+    """Gera a chave exata do contexto em que uma mensagem do chatbot foi feita."""
+    history = [(msg.get('role'), msg.get('content')) for msg in chat_history or []]
+    raw = orjson.dumps([context, history])
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _normalize_message(message: str) -> str:
+    """Normaliza espaços e maiúsculas/minúsculas de uma mensagem do chatbot."""
+    return " ".join(message.split()).casefold()
+
+
+def _command_signature(normalized: str) -> Tuple[str, ...]:
+    """
+    Palavras de conteúdo de uma mensagem normalizada, ordenadas.
+    
+    Números, IDs ("block1-2"), termos citados e substantivos ("python" x
+    "java") mudam o comando sem mudar quase nada do embedding: duas mensagens
+    só são equivalentes se a assinatura coincidir. Podem variar apenas artigos,
+    preposições e verbos sinônimos ("remova" / "apague").
+    """
+    tokens = (_COMMAND_SYNONYMS.get(token, token) for token in _COMMAND_TOKEN_PATTERN.findall(normalized))
+    return tuple(sorted(token for token in tokens if token not in _COMMAND_STOPWORDS))
+
+
+async def _embed_messages(messages: List[str]) -> None:
+    """
+    Calcula, em uma única chamada, os embeddings normalizados (norma 1) das
+    mensagens que ainda não estão em _message_embeddings.
+    
+    Falhas do Gemini são ignoradas; nesse caso o cache semântico não acerta.
+    """
+    # numpy só é carregado quando há candidatas no cache, não na importação
+    # do app (startup mais rápido em cada worker que nunca usa o chatbot)
+    import numpy as np
+    
+    missing = [message for message in dict.fromkeys(messages) if message not in _message_embeddings]
+    if not missing:
+        return
+    try:
+        async with gemini_slot():
+            response = await client.aio.models.embed_content(
+                model=SEMANTIC_CACHE_MODEL,
+                contents=missing,
+                config=types.EmbedContentConfig(
+                    task_type="SEMANTIC_SIMILARITY",
+                    output_dimensionality=SEMANTIC_CACHE_DIM
+                )
+            )
+        vectors = np.asarray([embedding.values for embedding in response.embeddings], dtype=np.float32)
+    except Exception:
+        return
+    
+    for message, vector in zip(missing, vectors):
+        norm = np.linalg.norm(vector)
+        if norm:
+            _message_embeddings[message] = vector / norm
+    while len(_message_embeddings) > SEMANTIC_CACHE_MAX_ENTRIES:
+        _message_embeddings.popitem(last=False)
+
+
+def _semantic_cache_get_exact(context_key: str, message: str) -> Optional[str]:
+    """Resposta de uma mensagem idêntica (após normalizar) no mesmo contexto, sem embedding."""
+    normalized = _normalize_message(message)
+    for key, text, _, content in reversed(_semantic_cache):
+        if key == context_key and text == normalized:
+            return content
+    return None
+
+
+async def _semantic_cache_lookup(message: str, candidates: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    Resposta da candidata (mensagem normalizada, resposta) mais parecida com a
+    mensagem, se a similaridade for >= SEMANTIC_CACHE_THRESHOLD.
+    """
+    normalized = _normalize_message(message)
+    await _embed_messages([normalized, *(text for text, _ in candidates)])
+    query_vector = _message_embeddings.get(normalized)
+    if query_vector is None:
+        return None
+    
+    best_content, best_similarity = None, SEMANTIC_CACHE_THRESHOLD
+    for text, content in candidates:
+        vector = _message_embeddings.get(text)
+        if vector is None:
+            continue
+        _message_embeddings.move_to_end(text)
+        similarity = float(vector @ query_vector)
+        if similarity >= best_similarity:
+            best_content, best_similarity = content, similarity
+    return best_content
+
+
+def _semantic_cache_start(context_key: str, message: str) -> "Optional[asyncio.Task[Optional[str]]]":
+    """
+    Dispara a busca no cache semântico se o contexto tiver mensagens anteriores
+    com a mesma assinatura; sem candidatas retorna None, sem calcular embedding.
+    """
+    signature = _command_signature(_normalize_message(message))
+    candidates = [
+        (text, content)
+        for key, text, entry_signature, content in _semantic_cache
+        if key == context_key and entry_signature == signature
+    ]
+    if not candidates:
+        return None
+    return asyncio.ensure_future(_semantic_cache_lookup(message, candidates))
+
+
+async def _semantic_cache_race(
+    lookup: "Optional[asyncio.Task[Optional[str]]]",
+    generation: asyncio.Future
+) -> Optional[str]:
+    """
+    Usa o cache semântico sem atrasar a geração, que já foi disparada.
+    
+    A busca (_semantic_cache_start) corre em paralelo com a geração (ou com a
+    espera pelo primeiro pedaço, no streaming). Se ela terminar antes e houver
+    uma mensagem equivalente, retorna a resposta em cache (quem chama cancela a
+    geração); se a geração terminar antes, retorna None sem esperar a busca.
+    """
+    if lookup is None:
+        return None
+    await asyncio.wait((lookup, generation), return_when=asyncio.FIRST_COMPLETED)
+    if generation.done() or not lookup.done():
+        return None
+    return lookup.result()
+
+
+def _semantic_cache_put(context_key: str, message: str, content: str) -> None:
+    """Armazena uma resposta; o deque descarta a mais antiga quando cheio."""
+    normalized = _normalize_message(message)
+    _semantic_cache.append((context_key, normalized, _command_signature(normalized), content))
+
+
+# ============================================================================
+# SERVICE TIERS DO GEMINI
+# ============================================================================
+# - "priority": menor latência e não é descartado sob carga (mais caro) — usado
+#   no chatbot, em que o professor espera a resposta na tela
+# - "standard": padrão — usado em toda requisição HTTP síncrona (currículo,
+#   method cards, bulk), em que o cliente aguarda a resposta
+# O tier "flex" (best-effort, latência de minutos) não é usado: excede o timeout
+# do cliente (120s), e o trabalho assíncrono já vai para o Batch Mode.
+
+ServiceTier = Literal["standard", "priority"]
+
+
+async def call_gemini(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
+    cache: bool = False,
+    context_cache: bool = False,
+    service_tier: ServiceTier = "standard",
+    response_schema: Optional[object] = None,
+    cache_key: Optional[str] = None
+) -> str:
+    """
+    Função auxiliar para chamar a API Gemini (assíncrona, não bloqueia o event loop).
+    
+    Com cache=True, respostas para os mesmos (system_prompt, user_prompt, model)
+    são reaproveitadas do cache em memória. Use apenas em prompts determinísticos.
+    cache_key substitui a chave derivada dos prompts (e implica cache=True).
+    
+    Com context_cache=True, system_prompt é tratado como prefixo estável e
+    registrado no context cache do Gemini; apenas user_prompt é enviado como
+    conteúdo novo.
+    
+    service_tier escolhe o tier de processamento do Gemini (ver SERVICE TIERS).
+    
+    Com response_schema, a geração é restrita a JSON nesse schema (saída
+    estruturada) e o texto retornado já é JSON válido.
+    """
+    if not client:
+        raise ValueError("Cliente Gemini não inicializado. Verifique se a variável GEMINI_API_KEY está configurada no arquivo .env")
+    
+    model = model if model else GEMINI_MODEL
+    
+    if cache and cache_key is None:
+        cache_key = _response_cache_key(system_prompt, user_prompt, model)
+    if cache_key is not None:
+        cached = _response_cache_get(cache_key)
+        if cached is not None:
+            return cached
+    
+    contents, config = await _prepare_gemini_request(
+        system_prompt, user_prompt, model, context_cache, service_tier, response_schema
+    )
+    text = await _request_gemini(contents, model, config)
+    
+    if cache_key is not None:
+        _response_cache_put(cache_key, text)
+    return text
+
 
-def call_gemini(system_prompt: str, user_prompt: str, model: Optional[str] = None) -> str:
-    """Função auxiliar para chamar a API Gemini (síncrona)."""
+async def _anext_or_none(iterator: AsyncIterator):
+    """Próximo item de um iterador assíncrono, ou None quando ele termina (anext() só existe a partir do Python 3.10)."""
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def stream_gemini(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
+    context_cache: bool = False,
+    service_tier: ServiceTier = "standard",
+    response_schema: Optional[object] = None
+) -> AsyncIterator[str]:
+    """
+    Versão em streaming de call_gemini: produz o texto em pedaços à medida que
+    o Gemini gera, reduzindo a latência percebida ao tempo até o primeiro token.
+    
+    Não usa o cache de respostas; context_cache, service_tier e response_schema
+    funcionam como em call_gemini.
+    
+    Erros transitórios (429/5xx) são repetidos com a mesma política de
+    _generate_content até chegar o primeiro pedaço: antes dele nada foi
+    repassado ao cliente, então repetir não duplica texto.
+    """
     if not client:
         raise ValueError("Cliente Gemini não inicializado. Verifique se a variável GEMINI_API_KEY está configurada no arquivo .env")
     
-    # Combinar system e user prompt para Gemini
-    full_prompt = f"{system_prompt}\n\n{user_prompt}"
+    model = model if model else GEMINI_MODEL
+    contents, config = await _prepare_gemini_request(
+        system_prompt, user_prompt, model, context_cache, service_tier, response_schema
+    )
     
     try:
-        response = client.models.generate_content(
-            model=model if model else GEMINI_MODEL,
-            contents=full_prompt
-        )
+        async for attempt in AsyncRetrying(
+            wait=GEMINI_RETRY_WAIT,
+            stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+            retry=retry_if_exception(_is_retryable_gemini_error),
+            reraise=True
+        ):
+            with attempt:
+                # A vaga é liberada entre as tentativas; na que der certo, passa
+                # para slot_stack e fica reservada até o fim do stream
+                async with AsyncExitStack() as stack:
+                    await stack.enter_async_context(gemini_slot())
+                    stream = (await client.aio.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    )).__aiter__()
+                    first = await _anext_or_none(stream)
+                    slot_stack = stack.pop_all()
+        
+        async with slot_stack:
+            if first is not None and first.text:
+                yield first.text
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+    except Exception as e:
+        raise ValueError(f"Erro na API Gemini: {str(e)}")
+
+
+async def _prepare_gemini_request(
+    system_prompt: str,
+    user_prompt: str,
+    model: str,
+    context_cache: bool,
+    service_tier: ServiceTier,
+    response_schema: Optional[object] = None
+) -> Tuple[str, types.GenerateContentConfig]:
+    """Monta o conteúdo e a configuração de uma chamada ao Gemini."""
+    config_args = {}
+    if service_tier != "standard":
+        config_args["service_tier"] = service_tier
+    if response_schema is not None:
+        config_args["response_mime_type"] = "application/json"
+        config_args["response_schema"] = response_schema
+    
+    # O system prompt vai como system_instruction (ou dentro do context cache),
+    # sempre antes do conteúdo variável: prefixo idêntico entre chamadas
+    cached_content = await _get_context_cache(system_prompt, model) if context_cache else None
+    if cached_content:
+        config_args["cached_content"] = cached_content
+    else:
+        config_args["system_instruction"] = system_prompt
+    contents = user_prompt
+    
+    return contents, types.GenerateContentConfig(**config_args)
+
+
+def _is_retryable_gemini_error(error: BaseException) -> bool:
+    """Erros transitórios do Gemini: limite de taxa (429) ou falha do servidor (5xx)."""
+    return isinstance(error, errors.ServerError) or (
+        isinstance(error, errors.ClientError) and error.code == 429
+    )
+
+
+async def _generate_content(
+    contents: str,
+    model: str,
+    config: Optional[types.GenerateContentConfig] = None
+) -> types.GenerateContentResponse:
+    """
+    Chama generate_content respeitando gemini_slot() e repetindo erros
+    transitórios com backoff exponencial e jitter.
+    """
+    async for attempt in AsyncRetrying(
+        wait=GEMINI_RETRY_WAIT,
+        stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+        retry=retry_if_exception(_is_retryable_gemini_error),
+        reraise=True
+    ):
+        with attempt:
+            # A vaga só é mantida durante a chamada, não durante a espera do backoff
+            async with gemini_slot():
+                return await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config
+                )
+
+
+async def _request_gemini(
+    contents: str,
+    model: str,
+    config: Optional[types.GenerateContentConfig] = None
+) -> str:
+    """Executa a chamada ao Gemini e extrai o texto da resposta."""
+    try:
+        response = await _generate_content(contents, model, config)
         
         if not response:
             raise ValueError("Resposta vazia da API Gemini")
         
-        # Gemini retorna o texto diretamente via propriedade .text
-        if hasattr(response, 'text') and response.text:
-            return response.text
+        # Caminho rápido: Gemini retorna o texto diretamente via propriedade .text
+        try:
+            text = response.text
+        except AttributeError:
+            text = None
+        if text:
+            return text
         
-        # Fallback para estruturas alternadas de resposta
-        if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'content'):
-                if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                    part = candidate.content.parts[0]
-                    if hasattr(part, 'text'):
-                        return part.text
-                    return str(part)
-                if hasattr(candidate.content, 'text'):
-                    return candidate.content.text
-                return str(candidate.content)
+        # Fallback: texto da primeira parte do primeiro candidato
+        try:
+            text = response.candidates[0].content.parts[0].text
+        except (AttributeError, IndexError, TypeError):
+            text = None
+        if text:
+            return text
         
         # Se chegou aqui, a resposta não está no formato esperado
-        raise ValueError(f"Formato de resposta inesperado da API Gemini. Tipo: {type(response)}, Atributos: {dir(response)[:10]}")
+        raise ValueError(f"Formato de resposta inesperado da API Gemini. Tipo: {type(response).__mro__}")
             
     except Exception as e:
         raise ValueError(f"Erro na API Gemini: {str(e)}")
 
 
+# ============================================================================
+# EXTRAÇÃO DE JSON DAS RESPOSTAS
+# ============================================================================
+# Respostas em texto livre podem trazer o JSON cercado de explicações ou de
+# blocos markdown. Os padrões capturam do primeiro '['/'{' ao último ']'/'}'.
+
+JSON_ARRAY_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+# Respostas que não puderam ser interpretadas vão para o log do servidor (não
+# para o detail do erro enviado ao cliente), truncadas em um tamanho fixo
+logger = logging.getLogger(__name__)
+_content_repr = Repr()
+_content_repr.maxstring = 300
+_content_repr.maxother = 300
+
+
+def extract_json(content: str, pattern: "re.Pattern[str]" = JSON_ARRAY_PATTERN):
+    """
+    Extrai e decodifica o trecho JSON mais externo de uma resposta do Gemini.
+    
+    Args:
+        content: Texto retornado pelo Gemini
+        pattern: JSON_ARRAY_PATTERN (padrão) ou JSON_OBJECT_PATTERN
+    
+    Returns:
+        O valor decodificado, ou None se não houver trecho JSON no texto
+    
+    Raises:
+        orjson.JSONDecodeError: Se o trecho encontrado não for JSON válido
+    """
+    match = pattern.search(content)
+    if match is None:
+        return None
+    return orjson.loads(match.group(0))
+
+
+class JsonArrayTracker:
+    """
+    Acompanha um array JSON recebido em pedaços (streaming) e detecta onde ele
+    termina, sem esperar a resposta completa nem reprocessar o que já foi lido.
+    
+    Controla profundidade de colchetes/chaves, strings e escapes entre pedaços.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+    
+    def feed(self, chunk: str) -> int:
+        """
+        Processa o próximo pedaço do texto.
+        
+        Returns:
+            int: Índice (no pedaço) do ']' que fecha o array de nível superior,
+            ou -1 se ele ainda não terminou
+        """
+        for index, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.started
+            elif char in '[{':
+                self.started = self.started or char == '['
+                if self.started:
+                    self.depth += 1
+            elif char in ']}' and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return index
+        return -1
+
+
 # ============================================================================
 # FUNÇÕES DE PROCESSAMENTO COM IA
 # ============================================================================
@@ -209,7 +1656,8 @@ async def research_topic(topic: str) -> List[Dict]:
     
     FLUXO:
     1. Recebe tópico do usuário
-    2. Chama Gemini com prompt especializado em pesquisa acadêmica
+    2. Chama Gemini com prompt especializado em pesquisa acadêmica (ou reaproveita
+       a resposta em cache para o mesmo tópico normalizado)
     3. Extrai JSON com fontes (livros, artigos, ensaios)
     4. Retorna lista de fontes estruturadas
     
@@ -219,7 +1667,7 @@ async def research_topic(topic: str) -> List[Dict]:
     Returns:
         List[Dict]: Lista de fontes com campos: title, authors, type, description, relevance
     """
-    system_prompt = "Você é um pesquisador acadêmico especialista. Forneça recomendações de fontes de pesquisa precisas e bem estruturadas. Responda sempre em português brasileiro."
+    system_prompt = RESEARCH_SYSTEM_PROMPT
     
     user_prompt = f"""Pesquise o tópico "{topic}" e forneça uma lista de 8-12 fontes de pesquisa de alta qualidade, incluindo:
 - Livros acadêmicos
@@ -238,27 +1686,72 @@ Formate como um array JSON com os campos: title, authors, type, description, rel
 Seja específico e foque em obras fundamentais e contemporâneas. Responda em português brasileiro."""
 
     try:
-        content = await asyncio.to_thread(call_gemini, system_prompt, user_prompt)
+        # Pesquisas do mesmo tópico (ignorando maiúsculas/espaços) vêm do cache
+        content = await call_gemini(
+            system_prompt,
+            user_prompt,
+            cache_key=_topic_cache_key("research", topic)
+        )
         
         # Tentar extrair JSON da resposta
         try:
-            # Encontrar array JSON na resposta
-            start_idx = content.find('[')
-            end_idx = content.rfind(']') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = content[start_idx:end_idx]
-                sources = json.loads(json_str)
-                return sources
-            else:
-                # Fallback: parsear como texto estruturado
-                return parse_sources_from_text(content)
-        except json.JSONDecodeError:
+            sources = extract_json(content)
+        except orjson.JSONDecodeError:
+            sources = None
+        
+        if sources is None:
+            # Fallback: parsear como texto estruturado
             return parse_sources_from_text(content)
+        return normalize_research_sources(sources)
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao pesquisar tópico: {str(e)}")
 
 
+_SOURCE_FIELDS = ('title', 'authors', 'type', 'description', 'relevance')
+
+
+def normalize_research_sources(sources) -> List[Dict]:
+    """
+    Converte as fontes geradas pelo Gemini para o formato de ResearchSource.
+    
+    O modelo às vezes devolve autores como lista ou campos nulos/numéricos; as
+    fontes voltam do frontend em outras requisições (sessão, chatbot) e seriam
+    rejeitadas na validação. Itens que não são objetos são descartados.
+    """
+    if not isinstance(sources, list):
+        return []
+    
+    normalized = []
+    for source in sources:
+        if not isinstance(source, dict):
+            continue
+        item = {}
+        for field in _SOURCE_FIELDS:
+            value = source.get(field)
+            if isinstance(value, list):
+                value = ", ".join(str(part) for part in value if part is not None)
+            item[field] = "" if value is None else str(value)
+        normalized.append(item)
+    return normalized
+
+
+# Palavras-chave (minúsculas) que identificam cada campo no texto livre
+_TITLE_KEYWORDS = ('título', 'title', 'livro', 'book')
+_AUTHOR_KEYWORDS = ('autor', 'author')
+_TYPE_KEYWORDS = ('tipo', 'type')
+_DESCRIPTION_KEYWORDS = ('descrição', 'description')
+_RELEVANCE_KEYWORDS = ('relevância', 'relevance')
+
+# Marcador de lista/numeração e rótulo do campo no início da linha
+# (ex.: "- Título: ...", "1. Autor: ...")
+_SOURCE_LABEL_PATTERN = re.compile(
+    r"^(?:-|\d+[.)])?\s*(?:(?:título|title|autores|autor|authors|author|tipo|type|"
+    r"descrição|description|relevância|relevance)\s*:\s*)?",
+    re.IGNORECASE
+)
+
+
 def parse_sources_from_text(text: str) -> List[Dict]:
     """
     Parser de fallback para quando a extração JSON falha.
@@ -281,25 +1774,30 @@ def parse_sources_from_text(text: str) -> List[Dict]:
         if not line or line.startswith('#'):
             continue
         
-        if 'título' in line.lower() or 'title' in line.lower() or 'livro' in line.lower() or 'book' in line.lower() or line.startswith('-'):
+        lower_line = line.lower()
+        value = _SOURCE_LABEL_PATTERN.sub('', line, count=1).strip()
+        
+        if any(key in lower_line for key in _TITLE_KEYWORDS) or line.startswith('-'):
             if current_source:
                 sources.append(current_source)
             current_source = {
-                "title": line.replace('-', '').replace('Título:', '').replace('Title:', '').strip(),
+                "title": value,
                 "authors": "",
                 "type": "livro",
                 "description": "",
                 "relevance": ""
             }
-        elif 'autor' in line.lower() or 'author' in line.lower():
-            current_source["authors"] = line.replace('Autor:', '').replace('Autores:', '').replace('Author:', '').replace('Authors:', '').strip()
-        elif 'tipo' in line.lower() or 'type' in line.lower():
-            current_source["type"] = line.replace('Tipo:', '').replace('Type:', '').strip().lower()
-        elif 'descrição' in line.lower() or 'description' in line.lower():
-            current_source["description"] = line.replace('Descrição:', '').replace('Description:', '').strip()
-        elif 'relevância' in line.lower() or 'relevance' in line.lower():
-            current_source["relevance"] = line.replace('Relevância:', '').replace('Relevance:', '').strip()
-        elif current_source and not any(key in line.lower() for key in ['título', 'title', 'autor', 'author', 'tipo', 'type', 'descrição', 'description', 'relevância', 'relevance']):
+        elif any(key in lower_line for key in _AUTHOR_KEYWORDS):
+            current_source["authors"] = value
+        elif any(key in lower_line for key in _TYPE_KEYWORDS):
+            current_source["type"] = value.lower()
+        elif any(key in lower_line for key in _DESCRIPTION_KEYWORDS):
+            current_source["description"] = value
+        elif any(key in lower_line for key in _RELEVANCE_KEYWORDS):
+            current_source["relevance"] = value
+        elif current_source:
+            # Nenhuma palavra-chave de campo na linha (os ramos acima já
+            # verificaram todas): texto livre complementa a fonte atual
             if not current_source.get("description"):
                 current_source["description"] = line
             elif not current_source.get("relevance"):
@@ -320,35 +1818,30 @@ def parse_sources_from_text(text: str) -> List[Dict]:
     return sources[:12]  # Limitar a 12 fontes
 
 
-async def generate_subtopics(topic: str, research_sources: List[Dict]) -> Dict[str, List[SubTopicCard]]:
+def build_subtopics_prompts(topic: str, research_sources: List[Dict]) -> Tuple[str, str]:
     """
-    Gera sub-tópicos como habilidades progressivas divididas em dois blocos principais.
+    Monta os prompts (system, user) usados para gerar o currículo em dois blocos.
     
-    FLUXO:
-    1. Prepara contexto com tópico e fontes de pesquisa
-    2. Chama Gemini com prompt especializado em design curricular
-    3. Extrai JSON com block1 e block2
-    4. Converte para formato SubTopicCard
-    5. Retorna currículo estruturado
+    Compartilhado entre a geração interativa (generate_subtopics) e o modo em lote.
     
     Args:
         topic: Tópico principal do currículo
         research_sources: Lista de fontes de pesquisa relevantes
     
     Returns:
-        Dict com 'block1' e 'block2', cada um contendo lista de SubTopicCard
+        Tuple[str, str]: (system_prompt, user_prompt)
     """
     
     # Preparar texto de fontes, se houver
     sources_section = ""
     if research_sources and len(research_sources) > 0:
-        sources_text = "\n".join([
+        sources_text = "\n".join(
             f"- {s.get('title', 'Desconhecido')} por {s.get('authors', 'Desconhecido')} ({s.get('type', 'fonte')})"
             for s in research_sources[:8]
-        ])
+        )
         sources_section = f"\n\nFontes de pesquisa relevantes:\n{sources_text}\n"
     
-    system_prompt = "Você é um especialista em design curricular baseado em competências. Crie habilidades progressivas e práticas que se constroem umas sobre as outras, focando em competências mensuráveis e aplicáveis. Responda sempre em português brasileiro."
+    system_prompt = CURRICULUM_SYSTEM_PROMPT
     
     user_prompt = f"""Com base no tópico "{topic}"{sources_section}
 
@@ -383,316 +1876,355 @@ Retorne APENAS um JSON válido com esta estrutura (sem texto adicional antes ou
 }}
 
 Responda sempre em português brasileiro."""
-
-    try:
-        content = await asyncio.to_thread(call_gemini, system_prompt, user_prompt)
-        
-        # Extrair JSON
-        start_idx = content.find('{')
-        end_idx = content.rfind('}') + 1
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = content[start_idx:end_idx]
-            try:
-                curriculum_data = json.loads(json_str)
-            except json.JSONDecodeError as je:
-                raise ValueError(f"Erro ao analisar JSON: {str(je)}. Conteúdo recebido: {content[:500]}")
-            
-            # Validar e converter para formato SubTopicCard
-            try:
-                result = {
-                    "block1": [
-                        SubTopicCard(
-                            id=f"block1-{i}",
-                            title=item.get("title", f"Habilidade {i+1}"),
-                            description=item.get("description", ""),
-                            order=i
-                        ).model_dump()
-                        for i, item in enumerate(curriculum_data.get("block1", []))
-                    ],
-                    "block2": [
-                        SubTopicCard(
-                            id=f"block2-{i}",
-                            title=item.get("title", f"Habilidade {i+1}"),
-                            description=item.get("description", ""),
-                            order=i
-                        ).model_dump()
-                        for i, item in enumerate(curriculum_data.get("block2", []))
-                    ]
-                }
-                
-                return result
-            except Exception as ce:
-                raise ValueError(f"Erro ao converter para SubTopicCard: {str(ce)}. Dados: {curriculum_data}")
-        else:
-            raise ValueError(f"Não foi possível encontrar JSON no conteúdo. Conteúdo recebido: {content[:500]}")
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar sub-tópicos: {str(e)}")
+    
+    return system_prompt, user_prompt
 
 
-async def generate_method_card_prompt(
-    topic: str,
-    subtopic_title: str,
-    subtopic_description: str,
-    previous_subtopics: List[Dict],
-    research_sources: List[Dict],
-    method_card_type: str
-) -> str:
+def parse_subtopics_content(content: str) -> Dict[str, List[Dict]]:
     """
-    Gera um prompt específico para um dos 5 method cards.
-    
-    FLUXO:
-    1. Recebe contexto do subtópico e curso
-    2. Seleciona prompt template baseado no tipo de method card
-    3. Chama Gemini com prompt especializado
-    4. Retorna prompt pronto para usar na ferramenta específica
-    
-    Tipos de method cards:
-    - 'video': Prompt para inVideo AI (vídeo educativo)
-    - 'theory': Prompt para NotebookLM (guia teórico)
-    - 'case_study': Roteiro para ElevenLabs (podcast educativo)
-    - 'practice': Código Python para Google Colab (visualização interativa)
-    - 'quiz': Questões para Google Forms (quiz de diagnóstico)
+    Extrai o JSON de currículo da resposta do Gemini e converte para SubTopicCard.
     
     Args:
-        topic: Tópico principal do curso
-        subtopic_title: Título do subtópico/habilidade
-        subtopic_description: Descrição do subtópico
-        previous_subtopics: Lista de subtópicos anteriores (para contexto)
-        research_sources: Fontes de pesquisa relevantes
-        method_card_type: Tipo de method card ('video', 'theory', etc.)
+        content: Texto retornado pelo Gemini
     
     Returns:
-        str: Prompt gerado pronto para usar na ferramenta específica
-    """
-    
-    # Preparar contexto de subitens anteriores
-    previous_context = ""
-    if previous_subtopics:
-        previous_context = "\n\nHabilidades Pré-requisitas já estudadas:\n"
-        for idx, prev in enumerate(previous_subtopics, 1):
-            previous_context += f"{idx}. {prev.get('title', '')}: {prev.get('description', '')}\n"
-    
-    # Preparar fontes relevantes
-    sources_text = ""
-    if research_sources:
-        sources_text = "\n\nFontes de Pesquisa Relevantes:\n"
-        sources_text += "\n".join([
-            f"- {s.get('title', 'Desconhecido')} por {s.get('authors', 'Unknown')} ({s.get('type', 'fonte')})"
-            for s in research_sources[:5]
-        ])
+        Dict com 'block1' e 'block2', cada um contendo lista de SubTopicCard serializados
     
-    # Selecionar e gerar o prompt baseado no tipo do method card
-    system_prompt = ""
-    user_prompt = ""
+    Raises:
+        ValueError: Se não houver JSON válido na resposta
+    """
+    # Extrair JSON
+    try:
+        curriculum_data = extract_json(content, JSON_OBJECT_PATTERN)
+    except orjson.JSONDecodeError as je:
+        logger.warning("JSON inválido no currículo (%s): %s", je, _content_repr.repr(content))
+        raise ValueError("Resposta do Gemini com JSON inválido")
     
-    if method_card_type == 'video':
-        # Method Card 1: Video Presentation (inVideo AI)
-        system_prompt = "Você é um Diretor Criativo de Documentários Científicos e Pedagogo especializado. Crie prompts otimizados para ferramentas de geração de vídeo educacional. Responda sempre em português brasileiro."
-        user_prompt = f"""Atue como um Diretor Criativo de Documentários Científicos e Pedagogo.
-Inspire-se em canais como 3blue1brown, Veritasium, Vsauce.
-Escreva um roteiro detalhado para um vídeo curto (60 a 90 segundos) que introduza um novo tópico aos meus alunos.
-
-TÓPICO DA AULA: {subtopic_title}
-CONTEXTO DO CURSO: {topic}
-DESCRIÇÃO DO SUBTÓPICO: {subtopic_description}
-{previous_context}{sources_text}
-
-Sua tarefa é escrever um "Prompt Otimizado" que será usado diretamente na ferramenta "InVideo AI".
-A estrutura narrativa do vídeo deve seguir a lógica da "Curiosidade Investigativa":
-1. **O Gancho (0-10s):** Comece com uma pergunta intrigante ou um fato contraintuitivo do mundo real conectado ao tema. (Misture curiosidade com um leve senso de urgência ou impacto).
-2. **A Ponte (10-40s):** Conecte esse fato à teoria que está sendo estudada, de maneira divertida. Use analogias visuais.
-3. **O Convite (40-90s):** Termine dizendo o que o aluno será capaz de fazer/resolver após dominar essa aula.
+    if curriculum_data is not None:
+        # Converter para o formato de SubTopicCard. Os dicts são montados
+        # diretamente: os dados acabaram de ser gerados aqui e seguem direto
+        # para a serialização, então a validação do Pydantic seria só custo
+        try:
+            result = {
+                "block1": [
+                    {
+                        "id": f"block1-{i}",
+                        "title": item.get("title", f"Habilidade {i+1}"),
+                        "description": item.get("description", ""),
+                        "order": i
+                    }
+                    for i, item in enumerate(curriculum_data.get("block1", []))
+                ],
+                "block2": [
+                    {
+                        "id": f"block2-{i}",
+                        "title": item.get("title", f"Habilidade {i+1}"),
+                        "description": item.get("description", ""),
+                        "order": i
+                    }
+                    for i, item in enumerate(curriculum_data.get("block2", []))
+                ]
+            }
+            
+            return result
+        except Exception as ce:
+            logger.warning("Currículo em formato inesperado (%s): %s", ce, _content_repr.repr(curriculum_data))
+            raise ValueError("Resposta do Gemini fora do formato de currículo esperado")
+    else:
+        logger.warning("Nenhum JSON no currículo: %s", _content_repr.repr(content))
+        raise ValueError("Resposta do Gemini sem JSON de currículo")
 
-SAÍDA ESPERADA:
-Escreva APENAS o prompt em inglês e inclua as configurações abaixo.
-Settings: - Language: Portuguese (Brazil) - Voice: Male and professional - Subtitles: Portuguese (Brazil)
-O prompt deve começar com: "Create a 60-second YouTube Short explaining [TOPIC] with a curious and energetic tone. Target audience: Students."
 
-IMPORTANTE: Retorne APENAS o prompt final, sem explicações adicionais."""
+async def generate_subtopics(topic: str, research_sources: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Gera sub-tópicos como habilidades progressivas divididas em dois blocos principais.
     
-    elif method_card_type == 'theory':
-        # Method Card 2: Theory Guide (NotebookLM)
-        system_prompt = "Você é um especialista em criar prompts otimizados para o NotebookLM. Gere prompts diretos, claros e específicos que o NotebookLM usará para criar conteúdo educacional. O prompt gerado deve ser copiado e colado diretamente no NotebookLM. Responda sempre em português brasileiro."
-        user_prompt = f"""Crie um prompt completo para o NotebookLM que gere um "Guia de Estudo Analítico" sobre o tópico abaixo.
-
-TÓPICO: {subtopic_title}
-CONTEXTO DO CURSO: {topic}
-DESCRIÇÃO: {subtopic_description}
-{previous_context}{sources_text}
-
-INSTRUÇÕES:
-O prompt que você vai gerar será usado DIRETAMENTE no NotebookLM. O NotebookLM lerá esse prompt e criará um guia de estudo completo para alunos de graduação.
-
-Gere um prompt que instrua o NotebookLM a:
-
-1. Assumir a persona de um Professor Pesquisador e Analista Crítico especializado em {topic}.
-
-2. Criar um Guia de Estudo Analítico completo e estruturado que inclua:
-
-   SEÇÃO 1 - Visão Geral e Relevância Estratégica:
-   - Definir tecnicamente o tópico "{subtopic_title}"
-   - Analisar sua importância estratégica fundamentando-se nas fontes disponíveis
-
-   SEÇÃO 2 - Análise dos Pilares Teóricos:
-   - Identificar e explicar os conceitos-chave (pilares teóricos) que sustentam o tópico
-   - Descrever como esses conceitos se relacionam e dependem uns dos outros
-
-   SEÇÃO 3 - Análise Crítica de Caso de Uso:
-   - Selecionar um caso de uso ou aplicação prática relevante relacionado ao tópico
-   - Analisar o problema que essa aplicação resolveu, o impacto gerado e os desafios enfrentados
-
-   SEÇÃO 4 - Implicações e Desafios:
-   - Discutir limitações, desafios de implementação e implicações técnicas do tópico
-
-   SEÇÃO 5 - Referências Bibliográficas:
-   - Listar todas as fontes utilizadas em formato acadêmico
-   - Usar citações inline numéricas [1], [2], [3] ao longo do texto sempre que informações vierem diretamente das fontes
-
-3. REGRAS IMPORTANTES:
-   - Usar citações inline [1], [2], etc. sempre que citar fontes
-   - Se uma seção não puder ser preenchida por falta de informações nas fontes, escrever o cabeçalho e declarar: "As fontes fornecidas não cobrem este ponto."
-   - Usar linguagem acadêmica, técnica e precisa, adequada para alunos de graduação
-   - O guia deve ser denso em informação e altamente didático
-
-FORMATO DE SAÍDA:
-Retorne APENAS o prompt pronto para ser usado no NotebookLM. O prompt deve começar diretamente com as instruções, como se você estivesse falando com o NotebookLM. Não inclua explicações ou metatexto. O professor vai copiar e colar seu prompt diretamente no NotebookLM.
-
-Exemplo de início do prompt: "Crie um Guia de Estudo Analítico sobre [tópico] seguindo esta estrutura: [...]" """
+    FLUXO:
+    1. Prepara contexto com tópico e fontes de pesquisa
+    2. Chama Gemini com prompt especializado em design curricular
+    3. Extrai JSON com block1 e block2
+    4. Converte para formato SubTopicCard
+    5. Retorna currículo estruturado
     
-    elif method_card_type == 'case_study':
-        # Method Card 3: Case Study Podcast
-        system_prompt = "Você é um Roteirista de Podcast Investigativo especializado em conteúdo educacional. Crie roteiros envolventes estilo true crime para ensinar conceitos técnicos. Responda sempre em português brasileiro."
-        user_prompt = f"""Atue como um Roteirista de Podcast Investigativo (estilo "True Crime" ou "Discovery").
-Preciso de um roteiro completo para um episódio curto (3 a 5 minutos) sobre um Estudo de Caso.
-
-TÓPICO DA AULA: {subtopic_title}
-CONTEXTO DO CURSO: {topic}
-DESCRIÇÃO: {subtopic_description}
-{previous_context}{sources_text}
-
-Sua tarefa:
-1. **Encontre um Caso:** Busque um acidente real, falha famosa ou desafio histórico ligado a esse tópico. (Se não houver um caso famoso direto, crie um cenário hipotético ultra-realista em uma indústria).
-2. **Crie os Personagens:**
-    * **Host (Alex):** Curioso, faz as perguntas que o público leigo faria.
-    * **Especialista (Dra. Santos):** Especialista Sênior, explica a falha técnica usando os conceitos da disciplina ({topic}).
-3. **Estrutura do Roteiro:**
-    * **Abertura:** O som do desastre/problema. O contexto.
-    * **A Investigação:** O Host pergunta "O que deu errado?". A Especialista explica os conceitos técnicos envolvidos.
-    * **A Lição:** Como o problema é resolvido ou prevenido hoje.
-
-SAÍDA OBRIGATÓRIA:
-Escreva o roteiro em formato de diálogo teatral.
-Inclua "Marcadores de Emoção" entre parênteses para guiar a IA de voz (ex: [Tom sério], [Surpreso], [Didático]).
-
-IMPORTANTE: Retorne APENAS o roteiro completo, sem explicações adicionais."""
+    Args:
+        topic: Tópico principal do currículo
+        research_sources: Lista de fontes de pesquisa relevantes
     
-    elif method_card_type == 'practice':
-        # Method Card 4: Practice Visualization (Google Colab)
-        system_prompt = "Você é um Professor Criativo e Engenheiro especializado em Visualizações Científicas Interativas. Crie experiências de aprendizado visualmente envolventes com código Python executável para Google Colab. Seja criativo, didático e inspire curiosidade. Responda sempre em português brasileiro."
-        user_prompt = f"""**Contexto:**
-Você é um Professor Criativo especializado em criar experiências de aprendizado visualmente envolventes para a disciplina {topic}.
-Sua missão é criar um laboratório virtual interativo ou visualização didática no Google Colab que ajude os alunos a compreenderem profundamente o conceito.
-
-**Tópico da Aula:** {subtopic_title}
-**Descrição:** {subtopic_description}
-{previous_context}{sources_text}
-
-**Sua Tarefa:**
-Crie um código Python completo, executável e didático que demonstre visualmente o conceito estudado. Seja criativo e pense em formas interessantes de visualizar o fenômeno ou conceito - pode ser através de:
-- Gráficos interativos e animações
-- Simulações visuais
-- Visualizações comparativas
-- Aplicações interativas simples
-- Demonstrações práticas do conceito em ação
-
-**Orientações de Design:**
-1. **Criatividade Visual:** Pense em formas engenhosas e claras de mostrar o conceito. Use analogias visuais, animações, ou múltiplas perspectivas quando apropriado.
-2. **Didática:** Inclua comentários explicativos no código que ajudem o aluno a entender o que está acontecendo. Explique o "porquê", não apenas o "como".
-3. **Bibliotecas Flexíveis:** Use as bibliotecas que fizerem mais sentido para a visualização (matplotlib, plotly, numpy, pandas, etc.). Não há obrigatoriedade de usar widgets ou sliders - o importante é que a visualização seja clara e educativa.
-4. **Completude:** O código deve ser executável diretamente em uma célula do Google Colab, incluindo imports necessários.
-5. **Interpretação:** Adicione comentários ou prints que expliquem o que a visualização mostra e como ela ajuda a entender o conceito.
-6. **Robustez:** Trate erros matemáticos ou de entrada quando apropriado.
-
-**Formato de Saída:**
-Retorne APENAS o código Python puro, diretamente, sem blocos markdown, sem explicações antes ou depois, sem ```python``` ou formatação markdown. Apenas o código executável que pode ser copiado e colado diretamente em uma célula do Colab."""
+    Returns:
+        Dict com 'block1' e 'block2', cada um contendo lista de SubTopicCard
+    """
+    
+    system_prompt, user_prompt = build_subtopics_prompts(topic, research_sources)
     
-    elif method_card_type == 'quiz':
-        # Method Card 5: Quiz Questions
-        system_prompt = "Você é um Professor Universitário exigente, mas didático. Crie questões de múltipla escolha que testem compreensão prática, não memorização. Responda sempre em português brasileiro. Retorne APENAS texto simples (plain text), sem formatação Markdown, sem fórmulas LaTeX, sem símbolos especiais ou caracteres de formatação. Use apenas texto puro, fácil de ler, copiar e colar no Google Forms."
-        user_prompt = f"""Atue como um Professor Universitário exigente, mas didático.
-Com base no conteúdo abaixo, crie um "Quiz de Diagnóstico" com 4 questões de múltipla escolha.
+    try:
+        # Mesmo tópico normalizado e mesmo conjunto de fontes (em qualquer ordem)
+        cache_key = _topic_cache_key(
+            "subtopics", topic, *sorted(s.get('title', '') for s in research_sources)
+        )
+        content = await call_gemini(system_prompt, user_prompt, cache_key=cache_key)
+        return parse_subtopics_content(content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar sub-tópicos: {str(e)}")
 
-TÓPICO DA AULA: {subtopic_title}
-CONTEXTO DO CURSO: {topic}
-DESCRIÇÃO: {subtopic_description}
-{previous_context}{sources_text}
 
-REGRAS DE OURO PARA AS QUESTÕES:
-1. Proibido Decorar: Não faça perguntas de definição (ex: "O que é X?").
-2. Foco em Cenário: Crie situações-problema. Use frases como "Se a variável X dobrar...", "Em um cenário onde...", "Um profissional observou que...".
-3. Distratores Inteligentes: As alternativas erradas não devem ser absurdas. Elas devem representar erros comuns de conceito que os alunos costumam cometer.
-4. Aplicação Prática: Cada questão deve testar a capacidade de aplicar o conceito em uma situação real.
+def build_method_card_context(
+    previous_subtopics: List[Dict],
+    research_sources: List[Dict]
+) -> Tuple[str, str]:
+    """
+    Monta os trechos de contexto comuns a todos os method cards de um subtópico.
+    
+    Args:
+        previous_subtopics: Lista de subtópicos anteriores (para contexto)
+        research_sources: Fontes de pesquisa relevantes
+    
+    Returns:
+        Tuple[str, str]: (previous_context, sources_text), vazios quando não há dados
+    """
+    # Preparar contexto de subitens anteriores
+    previous_context = ""
+    if previous_subtopics:
+        previous_context = "\n\nHabilidades Pré-requisitas já estudadas:\n" + "".join(
+            f"{idx}. {prev.get('title', '')}: {prev.get('description', '')}\n"
+            for idx, prev in enumerate(previous_subtopics, 1)
+        )
+    
+    # Preparar fontes relevantes
+    sources_text = ""
+    if research_sources:
+        sources_text = "\n\nFontes de Pesquisa Relevantes:\n"
+        sources_text += "\n".join(
+            f"- {s.get('title', 'Desconhecido')} por {s.get('authors', 'Unknown')} ({s.get('type', 'fonte')})"
+            for s in research_sources[:5]
+        )
+    
+    return previous_context, sources_text
 
-FORMATO DE SAÍDA (texto simples, sem Markdown):
-Para cada questão, use este formato exato:
 
-Questão 1:
-[Enunciado com cenário prático, em texto simples, sem símbolos especiais ou formatação]
+def build_method_card_prompts(
+    topic: str,
+    subtopic_title: str,
+    subtopic_description: str,
+    previous_subtopics: List[Dict],
+    research_sources: List[Dict],
+    method_card_type: MethodCardType,
+    context: Optional[Tuple[str, str]] = None
+) -> Tuple[str, str, bool]:
+    """
+    Monta os prompts de um method card (compartilhado pelas versões normal e
+    em streaming).
+    
+    Args:
+        topic: Tópico principal do curso
+        subtopic_title: Título do subtópico/habilidade
+        subtopic_description: Descrição do subtópico
+        previous_subtopics: Lista de subtópicos anteriores (para contexto)
+        research_sources: Fontes de pesquisa relevantes
+        method_card_type: Tipo de method card ('video', 'theory', etc.)
+        context: Resultado de build_method_card_context(), quando já calculado
+    
+    Returns:
+        Tuple[str, str, bool]: (system_prompt, user_prompt, usar context cache).
+        Com context cache, o system_prompt é o contexto compartilhado do curso
+        e o prompt do card inteiro vai no user_prompt
+    """
+    previous_context, sources_text = context or build_method_card_context(
+        previous_subtopics, research_sources
+    )
+    
+    # Contexto compartilhado longo (muitos pré-requisitos/fontes) vai para o
+    # context cache do Gemini, reaproveitado pelos 5 cards do subtópico; o
+    # template do card é enviado sem ele
+    shared_context = f"{previous_context}{sources_text}"
+    use_context_cache = len(shared_context) >= CONTEXT_CACHE_MIN_CHARS
+    if use_context_cache:
+        previous_context = sources_text = ""
+    
+    # Preencher o template do tipo de method card
+    try:
+        user_template = METHOD_CARD_USER_TEMPLATES[method_card_type]
+    except KeyError:
+        raise ValueError(f"Tipo de method card inválido: {method_card_type}")
+    
+    user_prompt = user_template.format(
+        topic=topic,
+        subtopic_title=subtopic_title,
+        subtopic_description=subtopic_description,
+        previous_context=previous_context,
+        sources_text=sources_text
+    )
+    
+    system_prompt = METHOD_CARD_SYSTEM_PROMPTS[method_card_type]
+    
+    if use_context_cache:
+        return f"CONTEXTO DO CURSO: {topic}{shared_context}", f"{system_prompt}\n\n{user_prompt}", True
+    return system_prompt, user_prompt, False
 
-A) [Alternativa A - texto simples]
-B) [Alternativa B - texto simples]
-C) [Alternativa C - texto simples]
-D) [Alternativa D - texto simples]
 
-Questão 2:
-[Enunciado...]
+async def generate_method_card_prompt(
+    topic: str,
+    subtopic_title: str,
+    subtopic_description: str,
+    previous_subtopics: List[Dict],
+    research_sources: List[Dict],
+    method_card_type: MethodCardType,
+    service_tier: ServiceTier = "standard",
+    context: Optional[Tuple[str, str]] = None
+) -> str:
+    """
+    Gera um prompt específico para um dos 5 method cards.
+    
+    FLUXO:
+    1. Recebe contexto do subtópico e curso
+    2. Monta os prompts do tipo de method card (build_method_card_prompts)
+    3. Chama Gemini com prompt especializado (com o contexto compartilhado no
+       context cache quando ele é longo)
+    4. Retorna prompt pronto para usar na ferramenta específica
+    
+    Tipos de method cards:
+    - 'video': Prompt para inVideo AI (vídeo educativo)
+    - 'theory': Prompt para NotebookLM (guia teórico)
+    - 'case_study': Roteiro para ElevenLabs (podcast educativo)
+    - 'practice': Código Python para Google Colab (visualização interativa)
+    - 'quiz': Questões para Google Forms (quiz de diagnóstico)
+    
+    Args:
+        topic: Tópico principal do curso
+        subtopic_title: Título do subtópico/habilidade
+        subtopic_description: Descrição do subtópico
+        previous_subtopics: Lista de subtópicos anteriores (para contexto)
+        research_sources: Fontes de pesquisa relevantes
+        method_card_type: Tipo de method card ('video', 'theory', etc.)
+        service_tier: Tier do Gemini (ver SERVICE TIERS)
+        context: Resultado de build_method_card_context(), quando já calculado
+            para o subtópico (evita remontá-lo a cada tipo de card)
+    
+    Returns:
+        str: Prompt gerado pronto para usar na ferramenta específica
+    """
+    system_prompt, user_prompt, use_context_cache = build_method_card_prompts(
+        topic,
+        subtopic_title,
+        subtopic_description,
+        previous_subtopics,
+        research_sources,
+        method_card_type,
+        context
+    )
+    
+    try:
+        if use_context_cache:
+            content = await call_gemini(
+                system_prompt,
+                user_prompt,
+                GEMINI_MODEL,
+                context_cache=True,
+                service_tier=service_tier
+            )
+        else:
+            content = await call_gemini(
+                system_prompt,
+                user_prompt,
+                GEMINI_MODEL,
+                cache=True,
+                service_tier=service_tier
+            )
+        return content.strip()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar prompt do method card {method_card_type}: {str(e)}")
 
-A) [Alternativa A]
-B) [Alternativa B]
-C) [Alternativa C]
-D) [Alternativa D]
 
-[Continue para Questão 3 e Questão 4 no mesmo formato]
+# ============================================================================
+# MODO EM LOTE (GEMINI BATCH MODE)
+# ============================================================================
+# Para gerações que toleram minutos de espera (ex.: currículo completo), o Batch
+# Mode do Gemini custa 50% menos e tem limites de taxa maiores. O job é criado a
+# partir de um arquivo JSONL e o resultado é consultado depois pelo job_id.
 
-GABARITO:
-Questão 1: [Letra correta: A, B, C ou D]
-Questão 2: [Letra correta: A, B, C ou D]
-Questão 3: [Letra correta: A, B, C ou D]
-Questão 4: [Letra correta: A, B, C ou D]
+async def submit_batch(prompts: List[Tuple[str, str]], model: Optional[str] = None) -> str:
+    """
+    Envia um lote de prompts para o Gemini Batch Mode.
+    
+    FLUXO:
+    1. Monta uma linha JSONL por prompt ({"key": ..., "request": {...}})
+    2. Faz upload do arquivo JSONL via Files API
+    3. Cria o batch job apontando para o arquivo
+    
+    Args:
+        prompts: Lista de tuplas (key, prompt completo); a key identifica o resultado
+        model: Modelo a usar (padrão: GEMINI_MODEL)
+    
+    Returns:
+        str: Nome do batch job (ex.: 'batches/123'), usado para consultar o status
+    """
+    if not client:
+        raise ValueError("Cliente Gemini não inicializado. Verifique se a variável GEMINI_API_KEY está configurada no arquivo .env")
+    
+    lines = [
+        orjson.dumps({"key": key, "request": {"contents": [{"parts": [{"text": prompt}]}]}})
+        for key, prompt in prompts
+    ]
+    jsonl = io.BytesIO(b"\n".join(lines))
+    
+    uploaded = await client.aio.files.upload(
+        file=jsonl,
+        config=types.UploadFileConfig(mime_type="jsonl", display_name="curriculum-batch")
+    )
+    job = await client.aio.batches.create(model=model or GEMINI_MODEL, src=uploaded.name)
+    return job.name
 
-EXPLICAÇÕES:
-Questão 1: [Explicação da resposta correta e por que as outras estão erradas - texto simples, sem formatação]
-Questão 2: [Explicação - texto simples]
-Questão 3: [Explicação - texto simples]
-Questão 4: [Explicação - texto simples]
 
-REGRAS CRÍTICAS DE FORMATAÇÃO:
-- Use APENAS texto simples (plain text)
-- NÃO use Markdown (sem asteriscos, sem negrito, sem itálico, sem listas formatadas)
-- NÃO use fórmulas LaTeX (sem símbolos matemáticos especiais, escreva por extenso ou use notação simples)
-- NÃO use símbolos especiais ou caracteres de formatação
-- Use apenas letras, números, vírgulas, pontos, dois pontos e parênteses
-- Use quebras de linha simples para separar questões
-- Texto deve ser fácil de copiar e colar diretamente no Google Forms"""
+async def get_batch_results(job_id: str) -> Tuple[str, Optional[Dict[str, str]]]:
+    """
+    Consulta um batch job e, se concluído, baixa e extrai os textos gerados.
     
-    else:
-        raise ValueError(f"Tipo de method card inválido: {method_card_type}")
+    Args:
+        job_id: Nome do batch job retornado por submit_batch()
     
-    try:
-        content = await asyncio.to_thread(call_gemini, system_prompt, user_prompt, GEMINI_MODEL)
-        return content.strip()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar prompt do method card {method_card_type}: {str(e)}")
+    Returns:
+        Tuple[str, Optional[Dict[str, str]]]: (estado do job, {key: texto}) — os
+        resultados são None enquanto o job não tiver terminado com sucesso
+    """
+    if not client:
+        raise ValueError("Cliente Gemini não inicializado. Verifique se a variável GEMINI_API_KEY está configurada no arquivo .env")
+    
+    # Resultados de um job concluído não mudam: as consultas seguintes não
+    # precisam baixar o arquivo de novo
+    cache_key = _response_cache_key("batch", job_id, "")
+    cached = _response_cache_get(cache_key)
+    if cached is not None:
+        return "JOB_STATE_SUCCEEDED", orjson.loads(cached)
+    
+    job = await client.aio.batches.get(name=job_id)
+    state = job.state.value if job.state else "JOB_STATE_UNSPECIFIED"
+    if state != "JOB_STATE_SUCCEEDED" or not job.dest or not job.dest.file_name:
+        return state, None
+    
+    raw = await client.aio.files.download(file=job.dest.file_name)
+    results = {}
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        candidates = item.get("response", {}).get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        results[item.get("key", "")] = "".join(part.get("text", "") for part in parts)
+    
+    _response_cache_put(cache_key, orjson.dumps(results).decode())
+    return state, results
 
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
-    """Serve a página HTML principal."""
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    """
+    Serve a página HTML principal.
+    
+    FileResponse envia o arquivo em blocos sem bloquear o event loop (em vez de
+    ler o arquivo inteiro a cada requisição) e inclui ETag e Last-Modified.
+    """
+    return FileResponse("static/index.html", media_type="text/html; charset=utf-8")
 
 
 @app.post("/api/research")
@@ -709,11 +2241,13 @@ async def research_endpoint(request: TopicRequest):
         request: TopicRequest com campo 'topic'
     
     Returns:
-        JSONResponse: {"sources": List[Dict]} com fontes encontradas
+        Dict: {"sources": List[Dict]} com fontes encontradas
     """
     try:
         sources = await research_topic(request.topic)
-        return JSONResponse(content={"sources": sources})
+        return {"sources": sources}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -726,34 +2260,65 @@ async def generate_curriculum_endpoint(request: CurriculumRequest):
     FLUXO:
     1. Recebe tópico e fontes de pesquisa (opcional)
     2. Se já houver block1/block2, retorna como está
-    3. Senão, chama generate_subtopics() que usa Gemini
-    4. Retorna currículo estruturado em dois blocos
+    3. Se mode == 'batch', envia para o Gemini Batch Mode e retorna o job_id
+    4. Senão, chama generate_subtopics() que usa Gemini
+    5. Retorna currículo estruturado em dois blocos
     
     Args:
-        request: CurriculumRequest com topic, research_sources, block1, block2
+        request: CurriculumRequest com topic, research_sources, block1, block2, mode
     
     Returns:
-        JSONResponse: {"block1": [...], "block2": [...]} com habilidades geradas
+        Dict: {"block1": [...], "block2": [...]} com habilidades geradas,
+        ou {"job_id": str, "state": str} (HTTP 202) no modo em lote
     """
     try:
         # Se o currículo já existe com fontes, apenas retorná-lo
         if request.block1 or request.block2:
-            return JSONResponse(content={
-                "block1": request.block1,
-                "block2": request.block2
-            })
+            curriculum = {
+                "block1": [card.model_dump() for card in request.block1],
+                "block2": [card.model_dump() for card in request.block2]
+            }
+            return curriculum
         
         if not request.topic or not request.topic.strip():
             raise HTTPException(status_code=400, detail="Tópico não fornecido")
         
-        curriculum = await generate_subtopics(request.topic, request.research_sources or [])
-        return JSONResponse(content=curriculum)
+        # Modo em lote: enfileira no Batch Mode e retorna o job_id para consulta posterior
+        if request.mode == "batch":
+            system_prompt, user_prompt = build_subtopics_prompts(request.topic, request.research_sources or [])
+            job_id = await submit_batch([("curriculum", f"{system_prompt}\n\n{user_prompt}")])
+            return ORJSONResponse(content={"job_id": job_id, "state": "JOB_STATE_PENDING"}, status_code=202)
+        
+        return await generate_subtopics(request.topic, request.research_sources or [])
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar currículo: {str(e)}")
 
 
+@app.post("/api/session")
+async def create_session_endpoint(request: SessionRequest):
+    """
+    Endpoint de sessão: Registra tópico, fontes e currículo no servidor.
+    
+    As requisições de method card podem então enviar apenas session_id,
+    subtopic_id e o tipo. O frontend deve registrar de novo quando o currículo
+    ou as fontes mudarem (o id muda junto com o conteúdo).
+    
+    Args:
+        request: SessionRequest com topic, research_sources e curriculum
+    
+    Returns:
+        Dict: {"session_id": str}
+    """
+    session_id = await _session_put(CourseSession(
+        request.topic,
+        request.research_sources,
+        {"block1": request.curriculum.get("block1", []), "block2": request.curriculum.get("block2", [])}
+    ))
+    return {"session_id": session_id}
+
+
 @app.post("/api/generate-method-card-prompt")
 async def generate_method_card_prompt_endpoint(request: MethodCardRequest):
     """
@@ -765,103 +2330,293 @@ async def generate_method_card_prompt_endpoint(request: MethodCardRequest):
     3. Retorna prompt pronto para copiar e usar na ferramenta
     
     Args:
-        request: MethodCardRequest com todos os dados do subtópico
+        request: MethodCardRequest com session_id ou todos os dados do subtópico
     
     Returns:
-        JSONResponse: {"subtopic_id": str, "method_card_type": str, "prompt": str}
+        Dict: {"subtopic_id": str, "method_card_type": str, "prompt": str}
     """
+    subtopic = await resolve_subtopic_context(request)
     try:
-        prompt = await generate_method_card_prompt(
-            request.topic,
-            request.subtopic_title,
-            request.subtopic_description,
-            request.previous_subtopics,
-            request.research_sources,
-            request.method_card_type
-        )
-        return JSONResponse(content={
+        prompt = await generate_method_card_prompt(*subtopic, request.method_card_type)
+        return {
             "subtopic_id": request.subtopic_id,
             "method_card_type": request.method_card_type,
             "prompt": prompt
-        })
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def generate_feedback_questions(
-    actions: List[ChatbotAction],
-    topic: Optional[str],
-    curriculum: Dict
-) -> List[str]:
+def _sse_event(payload: Dict) -> bytes:
+    """Formata um payload como evento Server-Sent Events."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.post("/api/generate-method-card-prompt/stream")
+async def generate_method_card_prompt_stream_endpoint(request: MethodCardRequest):
+    """
+    Endpoint de geração de prompts em streaming (Server-Sent Events).
+    
+    FLUXO:
+    1. Monta os mesmos prompts de /api/generate-method-card-prompt
+    2. Repassa cada pedaço gerado pelo Gemini como evento {"delta": str}
+       (uma resposta do cache de respostas sai como um único delta)
+    3. Emite um evento final no formato de MethodCardResponse
+    
+    Útil para os cards longos (theory, practice): o texto aparece no tempo até
+    o primeiro token.
+    
+    Args:
+        request: MethodCardRequest com session_id ou todos os dados do subtópico
+    
+    Returns:
+        StreamingResponse: Eventos SSE (text/event-stream)
+    """
+    subtopic = await resolve_subtopic_context(request)
+    
+    async def event_stream():
+        try:
+            system_prompt, user_prompt, use_context_cache = build_method_card_prompts(
+                *subtopic, request.method_card_type
+            )
+            
+            # Mesmo cache de respostas de /api/generate-method-card-prompt (que
+            # também não guarda as gerações feitas via context cache)
+            cache_key = None if use_context_cache else _response_cache_key(system_prompt, user_prompt, GEMINI_MODEL)
+            content = _response_cache_get(cache_key) if cache_key else None
+            if content is not None:
+                yield _sse_event({"delta": content})
+            else:
+                parts = []
+                async for delta in stream_gemini(
+                    system_prompt,
+                    user_prompt,
+                    GEMINI_MODEL,
+                    context_cache=use_context_cache
+                ):
+                    parts.append(delta)
+                    yield _sse_event({"delta": delta})
+                content = "".join(parts)
+                if cache_key:
+                    _response_cache_put(cache_key, content)
+            
+            response = MethodCardResponse(
+                subtopic_id=request.subtopic_id,
+                method_card_type=request.method_card_type,
+                prompt=content.strip()
+            )
+        except Exception as e:
+            response = MethodCardResponse(
+                subtopic_id=request.subtopic_id,
+                method_card_type=request.method_card_type,
+                prompt="",
+                error=str(e)
+            )
+        yield _sse_event(response.model_dump())
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/generate-method-card-prompts-bulk", response_model=List[MethodCardResponse])
+async def generate_method_card_prompts_bulk_endpoint(request: BulkMethodCardRequest):
+    """
+    Endpoint de geração em lote: Gera prompts de vários method cards de um subtópico.
+    
+    FLUXO:
+    1. Recebe contexto do subtópico e a lista de tipos de method card
+    2. Monta uma única vez o contexto comum (pré-requisitos e fontes)
+    3. Dispara uma chamada generate_method_card_prompt() por tipo, concorrentemente
+    4. Retorna um item por tipo, na mesma ordem solicitada
+    
+    As chamadas são independentes entre si, então o tempo total fica próximo ao
+    da chamada mais lenta em vez da soma de todas. A concorrência global é
+    limitada por gemini_slot() em _generate_content().
+    
+    Args:
+        request: BulkMethodCardRequest com session_id ou os dados do subtópico,
+            e method_card_types
+    
+    Returns:
+        List[MethodCardResponse]: Prompts gerados (com 'error' preenchido nos que falharam)
+    """
+    subtopic = await resolve_subtopic_context(request)
+    context = build_method_card_context(subtopic.previous_subtopics, subtopic.research_sources)
+    
+    results = await asyncio.gather(
+        *[
+            generate_method_card_prompt(
+                *subtopic,
+                method_card_type,
+                context=context
+            )
+            for method_card_type in request.method_card_types
+        ],
+        return_exceptions=True
+    )
+    
+    responses = []
+    for method_card_type, result in zip(request.method_card_types, results):
+        if isinstance(result, BaseException):
+            error = result.detail if isinstance(result, HTTPException) else str(result)
+            responses.append(MethodCardResponse(
+                subtopic_id=request.subtopic_id,
+                method_card_type=method_card_type,
+                prompt="",
+                error=error
+            ))
+        else:
+            responses.append(MethodCardResponse(
+                subtopic_id=request.subtopic_id,
+                method_card_type=method_card_type,
+                prompt=result
+            ))
+    # Já validadas: serializar direto, sem revalidar contra o response_model
+    return ORJSONResponse(content=[response.model_dump() for response in responses])
+
+
+@app.post("/api/generate-all-method-cards-batch")
+async def generate_all_method_cards_batch_endpoint(request: AllMethodCardsBatchRequest):
+    """
+    Endpoint de geração de todos os method cards em lote (Gemini Batch Mode).
+    
+    FLUXO:
+    1. Para cada subtópico dos dois blocos, monta os prompts dos tipos pedidos
+       (pré-requisitos = subtópicos anteriores do mesmo bloco)
+    2. Envia tudo em um único batch job, com key '{subtopic_id}:{tipo}'
+    3. Retorna o job_id para consulta em /api/batch-status
+    
+    Para preparar o curso inteiro sem pressa: custa 50% menos que a geração
+    interativa e não disputa os limites de taxa, mas pode levar horas.
+    
+    Args:
+        request: AllMethodCardsBatchRequest com topic, research_sources, block1,
+            block2 e method_card_types
+    
+    Returns:
+        Dict: {"job_id": str, "state": str, "count": int} (HTTP 202)
+    """
+    prompts = []
+    for block in (request.block1, request.block2):
+        for index, card in enumerate(block):
+            previous_subtopics = [previous.model_dump() for previous in block[:index]]
+            context = build_method_card_context(previous_subtopics, request.research_sources)
+            for method_card_type in dict.fromkeys(request.method_card_types):
+                system_prompt, user_prompt, _ = build_method_card_prompts(
+                    request.topic,
+                    card.title,
+                    card.description,
+                    previous_subtopics,
+                    request.research_sources,
+                    method_card_type,
+                    context
+                )
+                prompts.append((f"{card.id}:{method_card_type}", f"{system_prompt}\n\n{user_prompt}"))
+    
+    if not prompts:
+        raise HTTPException(status_code=400, detail="Currículo sem subtópicos")
+    
+    try:
+        job_id = await submit_batch(prompts)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao enviar lote: {str(e)}")
+    return ORJSONResponse(
+        content={"job_id": job_id, "state": "JOB_STATE_PENDING", "count": len(prompts)},
+        status_code=202
+    )
+
+
+@app.get("/api/batch-status/{job_id:path}")
+async def batch_status_endpoint(job_id: str):
+    """
+    Endpoint de status do modo em lote: Consulta um job criado por submit_batch().
+    
+    FLUXO:
+    1. Consulta o estado do batch job no Gemini
+    2. Se concluído, baixa os resultados e os indexa pela key de cada prompt
+    3. Para a key 'curriculum', também retorna o currículo já convertido em blocos
+    4. Para keys '{subtopic_id}:{tipo}', agrupa os prompts por subtópico
+    
+    Args:
+        job_id: Nome do batch job (ex.: 'batches/123')
+    
+    Returns:
+        Dict: {"job_id", "state", "results"?, "curriculum"?, "method_cards"?}
+    """
+    try:
+        state, results = await get_batch_results(job_id)
+        payload = {"job_id": job_id, "state": state}
+        if results is not None:
+            payload["results"] = results
+            if "curriculum" in results:
+                payload["curriculum"] = parse_subtopics_content(results["curriculum"])
+            method_cards = {}
+            for key, text in results.items():
+                subtopic_id, _, method_card_type = key.rpartition(":")
+                if subtopic_id and method_card_type in METHOD_CARDS:
+                    method_cards.setdefault(subtopic_id, {})[method_card_type] = text.strip()
+            if method_cards:
+                payload["method_cards"] = method_cards
+        return payload
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar lote: {str(e)}")
+
+
+def feedback_template(actions: List[ChatbotAction]) -> Optional[List[str]]:
+    """Perguntas prontas de _FEEDBACK_TEMPLATES, se todas as ações forem do mesmo tipo."""
+    if actions and len({action.type for action in actions}) == 1:
+        template = _FEEDBACK_TEMPLATES.get((actions[0].type, len(actions)))
+        if template:
+            return list(template)
+    return None
+
+
+async def generate_feedback_questions(user_message: str, topic: Optional[str]) -> List[str]:
     """
-    Gera 3 perguntas de feedback contextualizadas baseadas nas ações executadas.
+    Gera 3 perguntas de feedback contextualizadas a partir do comando do usuário.
     
-    FLUXO:
-    1. Recebe lista de ações que foram executadas
-    2. Chama Gemini para gerar perguntas relevantes sobre as mudanças
-    3. Retorna 3 perguntas para o usuário responder
+    Depende só do comando (não das ações já parseadas), então os endpoints do
+    chatbot a disparam especulativamente junto com a geração das ações pelo
+    Gemini e a cancelam se não houver ações ou se feedback_template() já as
+    cobrir.
     
     Args:
-        actions: Lista de ações executadas pelo chatbot
+        user_message: Comando do usuário em linguagem natural
         topic: Tópico do currículo
-        curriculum: Estado atual do currículo
     
     Returns:
         List[str]: Lista com exatamente 3 perguntas de feedback
     """
-    if not actions or len(actions) == 0:
-        return []
-    
-    # Descrever ações executadas
-    actions_description = "Ações executadas:\n"
-    for i, action in enumerate(actions, 1):
-        if action.type == 'add':
-            actions_description += f"{i}. Adicionado card '{action.title}' no {action.blockId}\n"
-        elif action.type == 'edit':
-            actions_description += f"{i}. Editado card {action.cardId}\n"
-        elif action.type == 'remove':
-            actions_description += f"{i}. Removido card {action.cardId}\n"
-        elif action.type == 'reorder':
-            actions_description += f"{i}. Reordenados cards no {action.blockId}\n"
-    
-    system_prompt = """Você é um assistente educacional que ajuda professores a refinar seus currículos.
-Após executar mudanças no currículo, você deve gerar 3 perguntas de feedback relevantes e úteis.
-
-As perguntas devem:
-- Ser específicas ao contexto das ações executadas
-- Ajudar o professor a pensar em melhorias ou ajustes
-- Ser curtas e diretas
-- Ser em português brasileiro
-- Variar entre: verificação de satisfação, sugestões de melhoria, e necessidades adicionais
-
-Retorne APENAS um array JSON com exatamente 3 strings (perguntas), sem texto adicional.
-Formato: ["Pergunta 1?", "Pergunta 2?", "Pergunta 3?"]"""
+    system_prompt = FEEDBACK_SYSTEM_PROMPT
     
     user_prompt = f"""Tópico do currículo: {topic or 'Não especificado'}
 
-{actions_description}
+Comando executado no currículo: {user_message}
 
 Gere 3 perguntas de feedback relevantes sobre essas mudanças."""
     
     try:
-        content = await asyncio.to_thread(call_gemini, system_prompt, user_prompt, GEMINI_MODEL)
+        content = await call_gemini(
+            system_prompt, user_prompt, GEMINI_MODEL, service_tier="priority",
+            response_schema=FEEDBACK_QUESTIONS_SCHEMA
+        )
         
-        # Extrair JSON da resposta
-        start_idx = content.find('[')
-        end_idx = content.rfind(']') + 1
+        # Saída estruturada: o texto já é o array JSON, sem precisar extraí-lo
+        questions = orjson.loads(content)
         
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = content[start_idx:end_idx]
-            questions = json.loads(json_str)
-            
-            # Garantir que temos exatamente 3 perguntas
-            if isinstance(questions, list) and len(questions) >= 3:
-                return questions[:3]
-            elif isinstance(questions, list) and len(questions) > 0:
-                # Se tiver menos de 3, completar com perguntas genéricas
-                while len(questions) < 3:
-                    questions.append("Há algo mais que você gostaria de ajustar no currículo?")
-                return questions[:3]
+        # Garantir que temos exatamente 3 perguntas
+        if isinstance(questions, list) and len(questions) >= 3:
+            return questions[:3]
+        elif isinstance(questions, list) and len(questions) > 0:
+            # Se tiver menos de 3, completar com perguntas genéricas
+            while len(questions) < 3:
+                questions.append("Há algo mais que você gostaria de ajustar no currículo?")
+            return questions[:3]
         
         # Fallback: perguntas genéricas
         return [
@@ -878,256 +2633,576 @@ Gere 3 perguntas de feedback relevantes sobre essas mudanças."""
         ]
 
 
-async def parse_chatbot_command(
+async def collect_feedback_questions(
+    actions: List[ChatbotAction],
+    feedback_task: "Optional[asyncio.Task[List[str]]]",
+    user_message: str,
+    topic: Optional[str]
+) -> Optional[List[str]]:
+    """
+    Decide as perguntas de feedback depois que as ações foram parseadas.
+    
+    Sem ações, não há perguntas; se feedback_template() cobrir as ações, usa as
+    perguntas prontas. Nos dois casos a geração especulativa é cancelada; caso
+    contrário, aguarda o resultado dela. feedback_task é None quando o comando
+    foi resolvido sem gerar (template local ou cache semântico): aí as perguntas
+    só são geradas se realmente forem usadas.
+    """
+    template = feedback_template(actions) if actions else None
+    if not actions or template is not None:
+        if feedback_task is not None:
+            feedback_task.cancel()
+        return template
+    if feedback_task is None:
+        return await generate_feedback_questions(user_message, topic)
+    return await feedback_task
+
+
+@functools.lru_cache(maxsize=256)
+def _render_curriculum(curriculum_json: bytes, topic: Optional[str]) -> str:
+    """
+    Renderiza o estado do currículo para o prompt do chatbot.
+    
+    Recebe o currículo como JSON canônico (chaves ordenadas) para que currículos
+    iguais compartilhem a entrada do lru_cache.
+    """
+    curriculum = orjson.loads(curriculum_json)
+    
+    # Preparar contexto do currículo (fragmentos unidos com um único join)
+    parts: List[str] = [
+        "Estado atual do currículo:\n",
+        f"Tópico: {topic or 'Não especificado'}\n\n"
+    ]
+    for header, block_id in (
+        ("Bloco 1 (Fundamentos):\n", "block1"),
+        ("\nBloco 2 (Aplicações Práticas):\n", "block2")
+    ):
+        parts.append(header)
+        cards = curriculum.get(block_id, [])
+        if not cards:
+            parts.append("  (vazio)\n")
+        for i, card in enumerate(cards, 1):
+            card_id = card.get('id', 'N/A')
+            title = card.get('title', 'N/A')
+            description = card.get('description', 'N/A')[:100]
+            parts.append(f"  {i}. ID: {card_id} | Título: {title} | Descrição: {description}\n")
+    return "".join(parts)
+
+
+def build_chatbot_prompts(
     user_message: str,
     topic: Optional[str],
     curriculum: Dict,
     research_sources: Optional[List[Dict]] = None,
     chat_history: Optional[List[Dict]] = None
-) -> List[ChatbotAction]:
+) -> Tuple[str, str, str]:
     """
-    Parseia comando em linguagem natural em ações estruturadas usando Gemini.
-    
-    FLUXO:
-    1. Prepara contexto completo do currículo atual
-    2. Inclui histórico de chat para contexto conversacional
-    3. Chama Gemini com prompt especializado em parsing de comandos
-    4. Extrai JSON com ações estruturadas
-    5. Valida e retorna lista de ChatbotAction
+    Monta os prompts do chatbot. Compartilhado entre /api/chatbot e
+    /api/chatbot/stream.
     
-    O modelo tem autoridade criativa para:
-    - Criar múltiplos cards de uma vez
-    - Inferir títulos e descrições
-    - Ordenar logicamente (básico → avançado)
-    
-    Args:
-        user_message: Comando do usuário em linguagem natural
-        topic: Tópico do currículo
-        curriculum: Estado atual do currículo (block1 e block2)
-        research_sources: Fontes de pesquisa (opcional)
-        chat_history: Histórico de mensagens anteriores (opcional)
+    O system prompt é a constante CHATBOT_SYSTEM_PROMPT, idêntica em todas as
+    chamadas (e por isso reaproveitada via context cache); o estado do
+    currículo, as fontes, o histórico e o comando vão no user prompt.
     
     Returns:
-        List[ChatbotAction]: Lista de ações a serem executadas
+        Tuple[str, str, str]: (system_prompt, contexto do currículo e fontes, user_prompt)
     """
     
-    # Preparar contexto do currículo
-    curriculum_text = "Estado atual do currículo:\n"
-    curriculum_text += f"Tópico: {topic or 'Não especificado'}\n\n"
+    # Mesmo currículo entre mensagens consecutivas: texto renderizado uma vez
+    curriculum_json = orjson.dumps(
+        {"block1": curriculum.get("block1", []), "block2": curriculum.get("block2", [])},
+        option=orjson.OPT_SORT_KEYS
+    )
+    curriculum_text = _render_curriculum(curriculum_json, topic)
     
-    # Bloco 1
-    block1_cards = curriculum.get("block1", [])
-    curriculum_text += "Bloco 1 (Fundamentos):\n"
-    if block1_cards:
-        for i, card in enumerate(block1_cards, 1):
-            curriculum_text += f"  {i}. ID: {card.get('id', 'N/A')} | Título: {card.get('title', 'N/A')} | Descrição: {card.get('description', 'N/A')[:100]}\n"
-    else:
-        curriculum_text += "  (vazio)\n"
-    
-    # Bloco 2
-    block2_cards = curriculum.get("block2", [])
-    curriculum_text += "\nBloco 2 (Aplicações Práticas):\n"
-    if block2_cards:
-        for i, card in enumerate(block2_cards, 1):
-            curriculum_text += f"  {i}. ID: {card.get('id', 'N/A')} | Título: {card.get('title', 'N/A')} | Descrição: {card.get('description', 'N/A')[:100]}\n"
-    else:
-        curriculum_text += "  (vazio)\n"
+    # Preparar fontes de pesquisa, se houver
+    sources_text = ""
+    if research_sources:
+        sources_text = "\nFontes de pesquisa:\n" + "\n".join(
+            f"- {s.get('title', 'Desconhecido')} por {s.get('authors', 'Desconhecido')}"
+            for s in research_sources[:8]
+        ) + "\n"
     
     # Preparar histórico de chat se houver
     history_text = ""
     if chat_history:
-        history_text = "\nHistórico da conversa:\n"
-        for msg in chat_history[-5:]:  # Últimas 5 mensagens
-            role = msg.get('role', 'user')
-            content = msg.get('content', '')
-            history_text += f"{role}: {content}\n"
+        history_text = "\nHistórico da conversa:\n" + "".join(
+            f"{msg.get('role', 'user')}: {msg.get('content', '')}\n"
+            for msg in chat_history  # já truncado em ChatbotRequest
+        )
     
-    system_prompt = """Você é um assistente criativo e inteligente especializado em gerenciar currículos educacionais. 
-Sua tarefa é interpretar comandos em linguagem natural e convertê-los em ações estruturadas JSON.
-
-IMPORTANTE: Seja CRIATIVO e FLEXÍVEL. Você tem autoridade para:
-- Criar múltiplos cards de uma vez quando solicitado
-- Inferir títulos e descrições quando o usuário fornecer apenas um tópico geral
-- Dividir tópicos amplos em múltiplos cards específicos
-- Usar seu conhecimento educacional para criar descrições relevantes
-- Ser proativo: se o usuário pedir "5 cards sobre X", crie 5 cards diferentes e relevantes sobre aspectos de X
-- ORDENAR LOGICAMENTE: quando criar múltiplos cards, coloque os mais básicos/introdutórios PRIMEIRO (sem position, serão adicionados sequencialmente) e os mais avançados DEPOIS
-- PROGRESSÃO PEDAGÓGICA: organize os cards em ordem crescente de complexidade, do mais fundamental ao mais avançado
+    # Tudo o que muda entre chamadas vem depois das instruções fixas
+    # (CHATBOT_SYSTEM_PROMPT), que assim são sempre o mesmo prefixo em cache
+    context = f"{curriculum_text}{sources_text}"
+    
+    user_prompt = f"""{context}{history_text}
 
-Estrutura do currículo:
-- Existem dois blocos: "block1" (Fundamentos) e "block2" (Aplicações Práticas)
-- Cada card tem: id (string), title (string), description (string), order (int)
-- A lista é ordenada: ordem 0 = PRIMEIRO/INÍCIO/TOPO, ordem maior = ÚLTIMO/FIM/FINAL
+Comando do usuário: {user_message}
 
-IMPORTANTE SOBRE POSICIONAMENTO:
-- "Primeiro", "início", "topo", "começo" = ordem 0 (primeira posição)
-- "Último", "fim", "final", "final da lista" = maior ordem (última posição)
-- Quando adicionar um card SEM especificar posição, adicione ao FINAL (não inclua "position")
-- Quando adicionar "no início" ou "no começo", use position: 0
-- Quando adicionar "no final" ou "no fim", NÃO inclua "position" (será adicionado automaticamente ao final)
+Se não conseguir interpretar o comando, não retorne nenhuma ação."""
+    
+    return CHATBOT_SYSTEM_PROMPT, context, user_prompt
 
-Tipos de ações disponíveis:
-1. ADD: Adicionar novo card
-   {"type": "add", "blockId": "block1" ou "block2", "title": "título", "description": "descrição", "position": número opcional}
-   - Se não especificar posição, NÃO inclua o campo "position" (será adicionado ao final)
-   - Se especificar "no início" ou "primeiro", use "position": 0
-   - Se especificar "no final" ou "último", NÃO inclua "position"
 
-2. EDIT: Editar card existente
-   {"type": "edit", "cardId": "id-do-card", "title": "novo título" (opcional), "description": "nova descrição" (opcional)}
+def parse_chatbot_actions(content: str) -> List[ChatbotAction]:
+    """
+    Valida o array JSON de ações gerado pelo Gemini com CHATBOT_ACTIONS_SCHEMA.
+    
+    Ações inválidas são ignoradas; se o JSON for inválido, retorna [].
+    """
+    # Caminho rápido: parse e validação do array inteiro em uma única passada
+    # (a saída estruturada do Gemini quase sempre já segue o schema)
+    try:
+        return _CHATBOT_ACTIONS_ADAPTER.validate_json(content)
+    except ValidationError:
+        pass
+    
+    try:
+        actions_data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return []
+    
+    if not isinstance(actions_data, list):
+        return []
+    
+    # Validar e converter para ChatbotAction, uma a uma
+    actions = []
+    for action_data in actions_data:
+        try:
+            action = ChatbotAction.model_validate(action_data)
+            actions.append(action)
+        except ValidationError:
+            # Ignorar ações inválidas
+            continue
+    
+    return actions
 
-3. REMOVE: Remover card
-   {"type": "remove", "cardId": "id-do-card"}
 
-4. REORDER: Reordenar cards em um bloco
-   {"type": "reorder", "blockId": "block1" ou "block2", "cardIds": ["id1", "id2", "id3", ...]}
-   - O array cardIds deve conter TODOS os IDs do bloco na ordem desejada
-   - Primeiro ID no array = primeiro na lista (ordem 0)
-   - Último ID no array = último na lista (maior ordem)
+# Mensagens sem nenhum comando (vazias, saudações, agradecimentos): nunca geram
+# ações, então são respondidas com [] sem montar o prompt nem chamar o Gemini
+_TRIVIAL_MESSAGES: Final[frozenset] = frozenset({
+    "", "oi", "olá", "ola", "hi", "hello", "ok", "obrigado", "obrigada", "valeu"
+})
 
-REGRAS CRÍTICAS:
-- Retorne APENAS um array JSON válido de ações, sem texto adicional
-- Use os IDs exatos dos cards quando referenciar cards existentes
-- Para reordenar, forneça TODOS os IDs do bloco na ordem desejada
-- Seja preciso: use os IDs exatos do currículo fornecido
-- Seja CRIATIVO: quando o usuário pedir múltiplos cards, crie múltiplas ações ADD
-- Seja INTELIGENTE: se o usuário pedir "5 cards sobre Python", crie 5 cards diferentes sobre aspectos relevantes de Python
-- Seja PROATIVO: se faltar informação, use seu conhecimento para criar títulos e descrições relevantes
-- ORDENE LOGICAMENTE: quando criar múltiplos cards, coloque-os no array na ordem pedagógica correta - básico/fundamental PRIMEIRO, avançado DEPOIS
-- PROGRESSÃO: o primeiro card no array será o primeiro visualmente (mais básico), o último será o último (mais avançado)
-- NÃO retorne array vazio [] a menos que seja realmente impossível interpretar o comando
-- Responda sempre em português brasileiro quando necessário explicar algo
 
-Exemplos:
-Comando: "Adicione um card sobre 'Introdução a Python' no bloco 1"
-Resposta: [{"type": "add", "blockId": "block1", "title": "Introdução a Python", "description": "Conceitos básicos da linguagem Python"}]
-(Não inclui "position" - será adicionado ao final)
+def is_trivial_message(message: str) -> bool:
+    """Indica se a mensagem do chat não contém nenhum comando a interpretar."""
+    normalized = _normalize_message(message).strip("?!.,")
+    return len(normalized) < 2 or normalized in _TRIVIAL_MESSAGES
 
-Comando: "Crie 5 cards sobre Python no bloco 1"
-Resposta: [
-  {"type": "add", "blockId": "block1", "title": "Sintaxe Básica do Python", "description": "Aprendendo a estrutura fundamental da linguagem Python"},
-  {"type": "add", "blockId": "block1", "title": "Tipos de Dados e Variáveis", "description": "Compreendendo os tipos primitivos e como declarar variáveis"},
-  {"type": "add", "blockId": "block1", "title": "Estruturas de Controle", "description": "Condicionais (if/else) e loops (for/while) em Python"},
-  {"type": "add", "blockId": "block1", "title": "Estruturas de Dados", "description": "Listas, dicionários, tuplas e sets em Python"},
-  {"type": "add", "blockId": "block1", "title": "Funções e Módulos", "description": "Criando e organizando código com funções e módulos"}
-]
-NOTA: Os cards são adicionados na ordem do array - o primeiro será o primeiro na lista (mais básico), o último será o último (mais avançado). Sempre ordene do mais fundamental ao mais complexo.
 
-Comando: "Adicione 3 cards sobre machine learning no bloco 2"
-Resposta: [
-  {"type": "add", "blockId": "block2", "title": "Introdução ao Machine Learning", "description": "Conceitos fundamentais e tipos de aprendizado"},
-  {"type": "add", "blockId": "block2", "title": "Algoritmos de Classificação", "description": "Regressão logística, árvores de decisão e SVM"},
-  {"type": "add", "blockId": "block2", "title": "Validação e Métricas", "description": "Técnicas de validação cruzada e métricas de avaliação"}
-]
-NOTA: Sempre ordene do mais básico (primeiro no array) ao mais avançado (último no array). O primeiro card do array será o primeiro na lista visual.
+# Comandos frequentes e totalmente determinados pelo estado do currículo
+# ("mova o último card para o início", "remova o card block1-2") são resolvidos
+# localmente, sem chamar o Gemini. Comandos que exigem criar conteúdo (títulos,
+# descrições) ou ambíguos seguem para o modelo.
 
-Comando: "Adicione um card sobre 'Pré-requisitos' no início do bloco 1"
-Resposta: [{"type": "add", "blockId": "block1", "title": "Pré-requisitos", "description": "...", "position": 0}]
+_MOVE_COMMAND_PATTERN = re.compile(
+    r"(?:mova|mover|coloque|passe) o (primeiro|último|ultimo) card"
+    r"(?: do bloco ?([12]))? para o (início|inicio|começo|comeco|topo|final|fim)"
+)
+_REMOVE_COMMAND_PATTERN = re.compile(
+    r"(?:remova|remover|apague|exclua) o (?:card (block[12]-[\w-]+)|(primeiro|último|ultimo) card(?: do bloco ?([12]))?)"
+)
 
-Comando: "Mova o primeiro card do bloco 1 para o final"
-Resposta: [{"type": "reorder", "blockId": "block1", "cardIds": ["block1-1", "block1-2", "block1-0"]}]
-(block1-0 era o primeiro, agora é o último no array)
 
-Comando: "Mova o último card para o início"
-Resposta: [{"type": "reorder", "blockId": "block1", "cardIds": ["block1-2", "block1-0", "block1-1"]}]
-(block1-2 era o último, agora é o primeiro no array)
+def _resolve_block(curriculum: Dict, block_number: Optional[str]) -> Optional[str]:
+    """Bloco citado no comando ou, se omitido, o único bloco não vazio."""
+    if block_number:
+        return f"block{block_number}"
+    non_empty = [block_id for block_id in ("block1", "block2") if curriculum.get(block_id)]
+    return non_empty[0] if len(non_empty) == 1 else None
 
-Comando: "Edite o card block1-0 para ter o título 'Novo Título'"
-Resposta: [{"type": "edit", "cardId": "block1-0", "title": "Novo Título"}]
 
-Comando: "Remova o card sobre X"
-Resposta: [{"type": "remove", "cardId": "block1-2"}]"""
+def match_command_template(message: str, curriculum: Dict) -> Optional[str]:
+    """
+    Resolve localmente comandos de mover/remover cards por posição ou ID.
     
-    user_prompt = f"""{curriculum_text}{history_text}
-
-Comando do usuário: {user_message}
+    Args:
+        message: Comando do usuário
+        curriculum: Estado atual do currículo (block1 e block2)
+    
+    Returns:
+        Optional[str]: Array JSON de ações (mesmo formato da saída do Gemini),
+        ou None se o comando não corresponder a um modelo conhecido
+    """
+    command = _normalize_message(message).rstrip(".!")
+    
+    match = _MOVE_COMMAND_PATTERN.fullmatch(command)
+    if match:
+        which, block_number, target = match.groups()
+        block_id = _resolve_block(curriculum, block_number)
+        card_ids = [card.get("id") for card in curriculum.get(block_id, [])] if block_id else []
+        if len(card_ids) < 2 or not all(card_ids):
+            return None
+        moved = card_ids.pop(0 if which == "primeiro" else -1)
+        if target in ("final", "fim"):
+            card_ids.append(moved)
+        else:
+            card_ids.insert(0, moved)
+        return orjson.dumps([{"type": "reorder", "blockId": block_id, "cardIds": card_ids}]).decode()
+    
+    match = _REMOVE_COMMAND_PATTERN.fullmatch(command)
+    if match:
+        card_id, which, block_number = match.groups()
+        if card_id is None:
+            block_id = _resolve_block(curriculum, block_number)
+            cards = curriculum.get(block_id, []) if block_id else []
+            if not cards:
+                return None
+            card_id = cards[0 if which == "primeiro" else -1].get("id")
+        elif not any(card.get("id") == card_id for block in curriculum.values() for card in block):
+            return None
+        if not card_id:
+            return None
+        return orjson.dumps([{"type": "remove", "cardId": card_id}]).decode()
+    
+    return None
 
-Retorne APENAS um array JSON com as ações a executar. Se não conseguir interpretar o comando, retorne [].
 
-Resposta (array JSON):"""
+async def parse_chatbot_command(
+    user_message: str,
+    topic: Optional[str],
+    curriculum: Dict,
+    research_sources: Optional[List[Dict]] = None,
+    chat_history: Optional[List[Dict]] = None,
+    on_generate: Optional[Callable[[], None]] = None
+) -> List[ChatbotAction]:
+    """
+    Parseia comando em linguagem natural em ações estruturadas usando Gemini.
+    
+    FLUXO:
+    1. Usa as instruções fixas do chatbot como system prompt (cacheável)
+    2. Inclui currículo atual, fontes e histórico de chat no user prompt
+    3. Ignora mensagens sem comando (is_trivial_message), resolve localmente
+       comandos simples (match_command_template), reaproveita
+       a resposta de um comando equivalente no mesmo contexto (cache semântico)
+       ou chama Gemini com prompt especializado
+    4. Gera JSON restrito a CHATBOT_ACTIONS_SCHEMA (saída estruturada)
+    5. Valida e retorna lista de ChatbotAction
+    
+    O modelo tem autoridade criativa para:
+    - Criar múltiplos cards de uma vez
+    - Inferir títulos e descrições
+    - Ordenar logicamente (básico → avançado)
+    
+    Args:
+        user_message: Comando do usuário em linguagem natural
+        topic: Tópico do currículo
+        curriculum: Estado atual do currículo (block1 e block2)
+        research_sources: Fontes de pesquisa (opcional)
+        chat_history: Histórico de mensagens anteriores (opcional)
+        on_generate: Chamado logo antes de gerar com o Gemini, só quando o
+            comando não foi resolvido localmente nem pelo cache (opcional)
+    
+    Returns:
+        List[ChatbotAction]: Lista de ações a serem executadas
+    """
+    if is_trivial_message(user_message):
+        return []
+    
+    local = match_command_template(user_message, curriculum)
+    if local is not None:
+        return parse_chatbot_actions(local)
+    
+    system_prompt, context, user_prompt = build_chatbot_prompts(
+        user_message, topic, curriculum, research_sources, chat_history
+    )
     
     try:
-        content = await asyncio.to_thread(call_gemini, system_prompt, user_prompt, GEMINI_MODEL)
+        context_key = _semantic_context_key(context, chat_history)
+        cached = _semantic_cache_get_exact(context_key, user_message)
+        if cached is not None:
+            return parse_chatbot_actions(cached)
         
-        # Extrair JSON da resposta
-        start_idx = content.find('[')
-        end_idx = content.rfind(']') + 1
+        if on_generate is not None:
+            on_generate()
+        # Geração e busca no cache semântico em paralelo
+        generation = asyncio.ensure_future(call_gemini(
+            system_prompt,
+            user_prompt,
+            GEMINI_MODEL,
+            context_cache=True,
+            service_tier="priority",
+            response_schema=CHATBOT_ACTIONS_SCHEMA
+        ))
+        lookup = _semantic_cache_start(context_key, user_message)
+        try:
+            cached = await _semantic_cache_race(lookup, generation)
+            if cached is not None:
+                return parse_chatbot_actions(cached)
+            content = await generation
+        except BaseException:
+            if lookup is not None:
+                lookup.cancel()
+            raise
+        finally:
+            generation.cancel()
         
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = content[start_idx:end_idx]
-            actions_data = json.loads(json_str)
-            
-            # Validar e converter para ChatbotAction
-            actions = []
-            for action_data in actions_data:
-                try:
-                    action = ChatbotAction(**action_data)
-                    actions.append(action)
-                except Exception as e:
-                    # Ignorar ações inválidas
-                    continue
-            
-            return actions
-        else:
-            return []
-            
-    except json.JSONDecodeError:
-        return []
+        _semantic_cache_put(context_key, user_message, content)
+        return parse_chatbot_actions(content)
     except Exception as e:
         raise ValueError(f"Erro ao parsear comando: {str(e)}")
 
 
-@app.post("/api/chatbot")
+def chatbot_response_payload(
+    actions: List[ChatbotAction],
+    feedback_questions: Optional[List[str]] = None,
+    error: Optional[str] = None
+) -> Dict:
+    """
+    Monta o corpo de resposta do chatbot (formato de ChatbotResponse) em uma
+    única passada sobre as ações.
+    
+    Campos None ficam de fora do payload: o frontend trata ausência e null do
+    mesmo jeito, exceto em position, em que null seria lido como posição 0.
+    """
+    payload: Dict = {"actions": [action.model_dump(exclude_none=True) for action in actions]}
+    if feedback_questions:
+        payload["feedback_questions"] = feedback_questions
+    if error is not None:
+        payload["error"] = error
+    return payload
+
+
+@app.post("/api/chatbot", response_model=ChatbotResponse)
 async def chatbot_endpoint(request: ChatbotRequest):
     """
     Endpoint do chatbot: Parseia comandos em linguagem natural e retorna ações + feedback.
     
     FLUXO:
     1. Recebe mensagem do usuário e estado atual do currículo
-    2. Chama parse_chatbot_command() para parsear comando
-    3. Se houver ações, chama generate_feedback_questions()
+    2. Chama parse_chatbot_command() para parsear comando e, se ele precisar
+       gerar com o Gemini, generate_feedback_questions() em paralelo
+       (especulativa)
+    3. Se houver ações, usa as perguntas geradas (ou as prontas, se couberem)
     4. Retorna ações + perguntas de feedback
     
     Args:
         request: ChatbotRequest com message, topic, curriculum, chat_history
     
     Returns:
-        JSONResponse: ChatbotResponse com actions e feedback_questions
+        ChatbotResponse: actions e feedback_questions (HTTP 500 com 'error' em caso de falha)
     """
+    # Sem comando: nenhuma ação, e nada de perguntas de feedback a gerar
+    if is_trivial_message(request.message):
+        return ORJSONResponse(content=chatbot_response_payload([]))
+    
+    # As perguntas de feedback dependem só do comando: gerá-las junto com as
+    # ações transforma duas chamadas sequenciais ao Gemini em duas paralelas.
+    # Só quando as ações são de fato geradas (não em template/cache)
+    feedback_task = None
+    
+    def start_feedback() -> None:
+        nonlocal feedback_task
+        feedback_task = asyncio.create_task(generate_feedback_questions(request.message, request.topic))
+    
     try:
         actions = await parse_chatbot_command(
             request.message,
             request.topic,
             request.curriculum,
             request.research_sources,
-            request.chat_history
+            request.chat_history,
+            on_generate=start_feedback
         )
         
-        # Gerar perguntas de feedback se houver ações
-        feedback_questions = []
-        if actions and len(actions) > 0:
-            feedback_questions = await generate_feedback_questions(
-                actions,
-                request.topic,
-                request.curriculum
-            )
-        
-        response = ChatbotResponse(
-            actions=[action.model_dump() for action in actions],
-            message=None,
-            feedback_questions=feedback_questions if feedback_questions else None
+        feedback_questions = await collect_feedback_questions(
+            actions, feedback_task, request.message, request.topic
         )
         
-        return JSONResponse(content=response.model_dump())
+        # Já validadas: serializar direto, sem revalidar contra o response_model
+        return ORJSONResponse(content=chatbot_response_payload(actions, feedback_questions))
         
     except Exception as e:
-        error_response = ChatbotResponse(
-            actions=[],
-            message=None,
-            error=str(e),
-            feedback_questions=None
-        )
-        return JSONResponse(content=error_response.model_dump(), status_code=500)
+        return ORJSONResponse(content=chatbot_response_payload([], error=str(e)), status_code=500)
+    finally:
+        # Não gastar tokens com perguntas que não serão usadas
+        if feedback_task is not None:
+            feedback_task.cancel()
+
+
+@app.post("/api/chatbot/stream")
+async def chatbot_stream_endpoint(request: ChatbotRequest):
+    """
+    Endpoint do chatbot em streaming (Server-Sent Events).
+    
+    FLUXO:
+    1. Monta os mesmos prompts de /api/chatbot
+    2. Repassa cada pedaço gerado pelo Gemini como evento {"delta": str}
+       (resposta do cache semântico ou de um comando resolvido localmente
+       sai como um único delta)
+    3. Ao final, parseia o texto acumulado e usa as perguntas de feedback
+       geradas em paralelo com o stream (só disparadas quando há geração)
+    4. Emite um evento final no formato de ChatbotResponse
+    
+    O frontend começa a receber dados no tempo até o primeiro token, em vez de
+    esperar a geração completa.
+    
+    Args:
+        request: ChatbotRequest com message, topic, curriculum, chat_history
+    
+    Returns:
+        StreamingResponse: Eventos SSE (text/event-stream)
+    """
+    async def event_stream():
+        # Sem comando: só o evento final, sem chamar o Gemini
+        if is_trivial_message(request.message):
+            yield _sse_event(chatbot_response_payload([]))
+            return
+        
+        feedback_task = None
+        try:
+            system_prompt, context, user_prompt = build_chatbot_prompts(
+                request.message,
+                request.topic,
+                request.curriculum,
+                request.research_sources,
+                request.chat_history
+            )
+            
+            context_key = _semantic_context_key(context, request.chat_history)
+            cached = match_command_template(request.message, request.curriculum)
+            if cached is None:
+                cached = _semantic_cache_get_exact(context_key, request.message)
+            
+            if cached is not None:
+                content = cached
+                yield _sse_event({"delta": content})
+            else:
+                # Perguntas de feedback em paralelo com a geração das ações
+                feedback_task = asyncio.create_task(generate_feedback_questions(request.message, request.topic))
+                stream = stream_gemini(
+                    system_prompt,
+                    user_prompt,
+                    GEMINI_MODEL,
+                    context_cache=True,
+                    service_tier="priority",
+                    response_schema=CHATBOT_ACTIONS_SCHEMA
+                )
+                # A busca no cache semântico disputa com o primeiro pedaço: depois
+                # que o stream começou a ser repassado, a resposta só é guardada
+                lookup = _semantic_cache_start(context_key, request.message)
+                first_delta = asyncio.ensure_future(_anext_or_none(stream))
+                try:
+                    content = await _semantic_cache_race(lookup, first_delta)
+                    if content is not None:
+                        yield _sse_event({"delta": content})
+                    else:
+                        parts = []
+                        tracker = JsonArrayTracker()
+                        delta = await first_delta
+                        while delta is not None:
+                            end = tracker.feed(delta)
+                            if end >= 0:
+                                delta = delta[:end + 1]
+                            parts.append(delta)
+                            yield _sse_event({"delta": delta})
+                            if end >= 0:
+                                # Array de ações completo: encerrar o stream (e liberar
+                                # o gemini_slot) sem esperar o fim da geração
+                                break
+                            delta = await _anext_or_none(stream)
+                        content = "".join(parts)
+                        _semantic_cache_put(context_key, request.message, content)
+                except BaseException:
+                    if lookup is not None:
+                        lookup.cancel()
+                    raise
+                finally:
+                    # O stream só pode ser fechado depois que a leitura pendente terminar
+                    first_delta.cancel()
+                    await asyncio.wait((first_delta,))
+                    await stream.aclose()
+            
+            actions = parse_chatbot_actions(content)
+            
+            feedback_questions = await collect_feedback_questions(
+                actions, feedback_task, request.message, request.topic
+            )
+            
+            yield _sse_event(chatbot_response_payload(actions, feedback_questions))
+            
+        except Exception as e:
+            yield _sse_event(chatbot_response_payload([], error=str(e)))
+        finally:
+            # Também cobre o cliente desconectar no meio do stream
+            if feedback_task is not None:
+                feedback_task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ============================================================================
+# REQUISIÇÕES EM LOTE (FAN-OUT)
+# ============================================================================
+# Permite ao frontend enviar várias chamadas à API em uma única requisição HTTP.
+# Cada sub-requisição é despachada diretamente para a função do endpoint (sem
+# passar de novo pela camada HTTP) e todas rodam concorrentemente.
+
+MAX_BATCH_SUBREQUESTS: Final[int] = 20
+
+# (método, url) -> (função do endpoint, modelo do corpo)
+BATCH_DISPATCH = {
+    ("POST", "/api/research"): (research_endpoint, TopicRequest),
+    ("POST", "/api/generate-curriculum"): (generate_curriculum_endpoint, CurriculumRequest),
+    ("POST", "/api/generate-method-card-prompt"): (generate_method_card_prompt_endpoint, MethodCardRequest),
+    ("POST", "/api/generate-method-card-prompts-bulk"): (generate_method_card_prompts_bulk_endpoint, BulkMethodCardRequest),
+    ("POST", "/api/chatbot"): (chatbot_endpoint, ChatbotRequest),
+}
+
+
+async def _dispatch_subrequest(sub: SubRequest) -> SubResponse:
+    """Executa uma sub-requisição chamando a função do endpoint correspondente."""
+    route = BATCH_DISPATCH.get((sub.method.upper(), sub.url))
+    if route is None:
+        return SubResponse(id=sub.id, status=404, body={"detail": f"Rota não suportada em lote: {sub.method} {sub.url}"})
+    
+    handler, request_model = route
+    try:
+        request = request_model(**(sub.body or {}))
+    except ValidationError as e:
+        return SubResponse(id=sub.id, status=422, body={"detail": jsonable_encoder(e.errors())})
+    
+    try:
+        result = await handler(request)
+    except HTTPException as e:
+        return SubResponse(id=sub.id, status=e.status_code, body={"detail": e.detail})
+    except Exception as e:
+        return SubResponse(id=sub.id, status=500, body={"detail": str(e)})
+    
+    if isinstance(result, Response):
+        body = orjson.loads(result.body) if result.body else None
+        return SubResponse(id=sub.id, status=result.status_code, body=body)
+    return SubResponse(id=sub.id, status=200, body=jsonable_encoder(result))
+
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def batch_endpoint(request: BatchRequest):
+    """
+    Endpoint de lote: Executa várias chamadas à API em uma única requisição.
+    
+    FLUXO:
+    1. Recebe uma lista de sub-requisições {id, method, url, body}
+    2. Despacha cada uma para a função do endpoint, concorrentemente
+    3. Retorna {id, status, body} de cada uma, na mesma ordem
+    
+    Falhas em uma sub-requisição não afetam as demais.
+    
+    Args:
+        request: BatchRequest com a lista de sub-requisições
+    
+    Returns:
+        BatchResponse: Respostas de cada sub-requisição
+    """
+    if len(request.requests) > MAX_BATCH_SUBREQUESTS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_BATCH_SUBREQUESTS} sub-requisições por lote")
+    
+    responses = await asyncio.gather(*[_dispatch_subrequest(sub) for sub in request.requests])
+    return ORJSONResponse(content=BatchResponse(responses=responses).model_dump())
 
 
 if __name__ == "__main__":
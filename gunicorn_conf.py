@@ -0,0 +1,24 @@
+"""Production server config. Run: gunicorn -c gunicorn_conf.py app:app"""
+
+import multiprocessing
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    """Uvicorn worker com uvloop (event loop) e httptools (parser HTTP)."""
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# Cada worker é um processo com seu próprio event loop, cliente Gemini e caches
+# em memória (MAX_CONCURRENT_GEMINI vale por worker)
+workers = int(os.getenv("WEB_CONCURRENCY", (2 * multiprocessing.cpu_count()) + 1))
+worker_class = UvloopWorker
+
+# Chamadas ao Gemini podem levar até 120s (timeout do cliente em app.py)
+timeout = 180
+graceful_timeout = 30
+keepalive = 75
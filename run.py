@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
-"""Dev server with auto-reload. Run: python run.py"""
+"""Dev server with auto-reload. Run: python run.py [--no-reload] [--workers N]"""
 
-import uvicorn
+import argparse
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Curriculum Curator Toolkit dev server")
+    parser.add_argument(
+        "--reload",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Recarrega automaticamente ao editar o código (padrão: ativo)"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Número de processos (exige --no-reload)")
+    args = parser.parse_args()
+    # O watcher do reload roda um único worker: não combinar com workers > 1.
+    # Em produção use gunicorn -c gunicorn_conf.py app:app
+    if args.reload and args.workers > 1:
+        parser.error("--workers > 1 exige --no-reload")
+
     print("🎓 Curriculum Curator Toolkit")
     print("📚 http://localhost:8000")
     print("🛑 Ctrl+C to stop\n")
-    
+
+    # Importado só depois do banner: --help e erros de argumento não o carregam
+    import uvicorn
+
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=True  # Recarrega automaticamente em desenvolvimento
+        reload=args.reload,
+        workers=args.workers
     )
-
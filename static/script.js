@@ -17,6 +17,7 @@ let editingCardId = null;
 let editingBlockId = null;
 let cardCounter = 0;
 let currentSessionId = null;
+let serverSession = { id: null, state: null };
 let workflowMode = 'manual';
 
 // Chatbot state
@@ -1214,12 +1215,6 @@ window.generateMethodCardPrompt = async function(methodCardType) {
         return;
     }
     
-    const previousSubtopics = [];
-    const cardIndex = curriculum[blockId].findIndex(c => c.id === currentMethodCardSubtopic);
-    for (let i = 0; i < cardIndex; i++) {
-        previousSubtopics.push(curriculum[blockId][i]);
-    }
-    
     const methodCard = document.querySelector(`.method-card[data-type="${methodCardType}"]`);
     const btn = methodCard ? methodCard.querySelector('.btn-primary') : null;
     const originalText = btn ? btn.textContent : 'Gerar';
@@ -1229,32 +1224,50 @@ window.generateMethodCardPrompt = async function(methodCardType) {
     }
     
     try {
-        const response = await fetch('/api/generate-method-card-prompt', {
+        const requestPrompt = (payload) => fetch('/api/generate-method-card-prompt/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                topic: currentTopic,
                 subtopic_id: currentMethodCardSubtopic,
+                method_card_type: methodCardType,
+                ...payload
+            })
+        });
+        
+        // The server already holds topic, sources and curriculum for the session
+        let response = await requestPrompt({ session_id: await ensureServerSession() });
+        if (response.status === 404) {
+            // Session expired or was not stored: send the full context this time
+            // and register the session again on the next request
+            serverSession.id = null;
+            const blockCards = curriculum[blockId];
+            response = await requestPrompt({
+                topic: currentTopic,
                 subtopic_title: card.title,
                 subtopic_description: card.description || '',
                 block_id: blockId,
-                previous_subtopics: previousSubtopics,
-                research_sources: researchSources,
-                method_card_type: methodCardType
-            })
-        });
+                previous_subtopics: blockCards.slice(0, blockCards.indexOf(card)),
+                research_sources: researchSources
+            });
+        }
         
         if (!response.ok) throw new Error('Falha na geração do prompt');
         
-        const data = await response.json();
+        // Render the prompt as it is generated
+        const promptTextarea = document.getElementById(`prompt-${methodCardType}`);
+        promptTextarea.value = '';
+        document.getElementById(`result-${methodCardType}`).style.display = 'block';
+        const data = await readEventStream(response, (delta) => {
+            promptTextarea.value += delta;
+        });
+        if (data.error) throw new Error(data.error);
         
         if (!methodCardPrompts[currentMethodCardSubtopic]) {
             methodCardPrompts[currentMethodCardSubtopic] = {};
         }
         methodCardPrompts[currentMethodCardSubtopic][methodCardType] = data.prompt;
         
-        document.getElementById(`prompt-${methodCardType}`).value = data.prompt;
-        document.getElementById(`result-${methodCardType}`).style.display = 'block';
+        promptTextarea.value = data.prompt;
         document.getElementById(`edit-${methodCardType}-btn`).style.display = 'inline-block';
         
         const methodCard = document.querySelector(`.method-card[data-type="${methodCardType}"]`);
@@ -1273,6 +1286,33 @@ window.generateMethodCardPrompt = async function(methodCardType) {
     }
 }
 
+/**
+ * Registers topic, sources and curriculum with POST /api/session when they
+ * changed, so method-card requests only need to send the session id.
+ */
+async function ensureServerSession() {
+    const state = JSON.stringify({
+        topic: currentTopic,
+        research_sources: researchSources,
+        curriculum: {
+            block1: curriculum.block1 || [],
+            block2: curriculum.block2 || []
+        }
+    });
+    if (serverSession.id && serverSession.state === state) return serverSession.id;
+    
+    const response = await fetch('/api/session', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: state
+    });
+    if (!response.ok) throw new Error('Falha ao registrar a sessão');
+    
+    const data = await response.json();
+    serverSession = { id: data.session_id, state };
+    return data.session_id;
+}
+
 function editMethodCardPrompt(methodCardType) {
     const textarea = document.getElementById(`prompt-${methodCardType}`);
     textarea.readOnly = !textarea.readOnly;
@@ -1371,7 +1411,7 @@ async function sendChatbotMessage() {
             return;
         }
         
-        const response = await fetch('/api/chatbot', {
+        const response = await fetch('/api/chatbot/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -1386,14 +1426,20 @@ async function sendChatbotMessage() {
             })
         });
         
-        removeChatMessage(loadingMessageId);
-        
         if (!response.ok) {
+            removeChatMessage(loadingMessageId);
             const errorText = await response.text();
             throw new Error(`Erro do servidor: ${response.status} - ${errorText}`);
         }
         
-        const data = await response.json();
+        // Show progress while the model is still generating
+        let receivedChars = 0;
+        const data = await readEventStream(response, (delta) => {
+            receivedChars += delta.length;
+            updateChatMessage(loadingMessageId, `Processando... (${receivedChars} caracteres recebidos)`);
+        });
+        
+        removeChatMessage(loadingMessageId);
         
         if (data.error) {
             addChatMessage('assistant', `Erro: ${data.error}`);
@@ -1448,6 +1494,51 @@ async function sendChatbotMessage() {
     }
 }
 
+/**
+ * Reads a Server-Sent Events stream (/api/chatbot/stream,
+ * /api/generate-method-card-prompt/stream).
+ * Calls onDelta for each {"delta"} event and resolves with the final
+ * payload (the last event, which has no "delta").
+ */
+async function readEventStream(response, onDelta) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+            if (!dataLine) continue;
+            
+            const payload = JSON.parse(dataLine.slice(6));
+            if (typeof payload.delta === 'string') {
+                onDelta(payload.delta);
+            } else {
+                result = payload;
+            }
+        }
+    }
+    
+    if (!result) throw new Error('Resposta incompleta do servidor');
+    return result;
+}
+
+function updateChatMessage(messageId, content) {
+    const messageDiv = document.getElementById(messageId);
+    if (!messageDiv) return;
+    const contentDiv = messageDiv.querySelector('.chatbot-message-content');
+    if (contentDiv) contentDiv.textContent = content;
+}
+
 function addChatMessage(role, content, isTemporary = false) {
     const messageId = `msg-${Date.now()}-${Math.random()}`;
     chatHistory.push({ role, content, timestamp: new Date().toISOString(), id: messageId });
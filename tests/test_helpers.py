@@ -0,0 +1,206 @@
+"""Testes dos helpers puros de parsing e correspondência de app.py."""
+
+import orjson
+import pytest
+
+from app import (
+    JsonArrayTracker,
+    _command_signature,
+    _normalize_message,
+    is_trivial_message,
+    match_command_template,
+    parse_sources_from_text,
+)
+
+
+# ============================================================================
+# JsonArrayTracker
+# ============================================================================
+
+def feed_all(chunks):
+    """Alimenta o tracker e retorna (índice do pedaço, índice no pedaço) do fim do array."""
+    tracker = JsonArrayTracker()
+    for chunk_index, chunk in enumerate(chunks):
+        end = tracker.feed(chunk)
+        if end >= 0:
+            return chunk_index, end
+    return None
+
+
+def test_tracker_finds_closing_bracket():
+    text = '[{"type": "add", "blockId": "block1"}]'
+    assert feed_all([text]) == (0, len(text) - 1)
+
+
+def test_tracker_ignores_brackets_inside_strings():
+    text = '[{"title": "Listas [a, b] e {chaves}"}]'
+    assert feed_all([text]) == (0, len(text) - 1)
+
+
+def test_tracker_handles_escaped_quotes():
+    text = r'[{"title": "Aspas \" ] dentro"}]'
+    assert feed_all([text]) == (0, len(text) - 1)
+
+
+def test_tracker_handles_escaped_backslash_before_quote():
+    text = r'[{"path": "C:\\"}, {"b": "]"}]'
+    assert feed_all([text]) == (0, len(text) - 1)
+
+
+def test_tracker_keeps_state_between_chunks():
+    # O escape e a string atravessam a divisão dos pedaços
+    chunks = ['[{"title": "a \\', '" ]', ' b"}', '] texto depois']
+    assert feed_all(chunks) == (3, 0)
+
+
+def test_tracker_ignores_text_before_the_array():
+    text = 'Aqui está: {"nota": "]"} [1, [2, 3]] fim'
+    assert feed_all([text]) == (0, text.index('] fim'))
+
+
+def test_tracker_without_closing_bracket():
+    assert feed_all(['[{"type": "add"', ', "title": "T"}']) is None
+
+
+# ============================================================================
+# match_command_template
+# ============================================================================
+
+CURRICULUM = {
+    "block1": [{"id": "block1-0"}, {"id": "block1-1"}, {"id": "block1-2"}],
+    "block2": [{"id": "block2-0"}, {"id": "block2-1"}],
+}
+
+
+def actions(content):
+    return orjson.loads(content) if content is not None else None
+
+
+def test_template_moves_last_card_to_start():
+    result = match_command_template("Mova o último card do bloco 1 para o início", CURRICULUM)
+    assert actions(result) == [
+        {"type": "reorder", "blockId": "block1", "cardIds": ["block1-2", "block1-0", "block1-1"]}
+    ]
+
+
+def test_template_moves_first_card_to_end_of_only_non_empty_block():
+    curriculum = {"block1": [], "block2": [{"id": "b"}, {"id": "c"}]}
+    result = match_command_template("mova o primeiro card para o final.", curriculum)
+    assert actions(result) == [{"type": "reorder", "blockId": "block2", "cardIds": ["c", "b"]}]
+
+
+def test_template_requires_block_when_ambiguous():
+    assert match_command_template("mova o primeiro card para o final", CURRICULUM) is None
+
+
+def test_template_removes_card_by_id():
+    result = match_command_template("Remova o card block2-1!", CURRICULUM)
+    assert actions(result) == [{"type": "remove", "cardId": "block2-1"}]
+
+
+def test_template_removes_last_card_of_block():
+    result = match_command_template("apague o ultimo card do bloco 2", CURRICULUM)
+    assert actions(result) == [{"type": "remove", "cardId": "block2-1"}]
+
+
+@pytest.mark.parametrize("message", [
+    "remova o card block1-9",  # ID inexistente
+    "remova o card block1-0 e adicione outro sobre vetores",  # comando composto
+    "remova o card sobre python",  # exige interpretar o conteúdo
+    "mova o último card do bloco 1 para depois do segundo",
+    "não remova o card block1-0",
+])
+def test_template_does_not_misfire(message):
+    assert match_command_template(message, CURRICULUM) is None
+
+
+def test_template_needs_two_cards_to_reorder():
+    curriculum = {"block1": [{"id": "a"}], "block2": []}
+    assert match_command_template("mova o último card para o início", curriculum) is None
+
+
+# ============================================================================
+# is_trivial_message
+# ============================================================================
+
+@pytest.mark.parametrize("message", ["", "   ", "a", "Oi!", "  OLÁ  ", "obrigado.", "ok", "Valeu!!"])
+def test_trivial_messages(message):
+    assert is_trivial_message(message)
+
+
+@pytest.mark.parametrize("message", [
+    "oi, adicione um card sobre vetores",
+    "remova o card block1-0",
+    "ok, mova o primeiro card para o fim",
+])
+def test_commands_are_not_trivial(message):
+    assert not is_trivial_message(message)
+
+
+# ============================================================================
+# parse_sources_from_text
+# ============================================================================
+
+def test_parse_sources_reads_labeled_fields():
+    text = """
+    1. Título: Física Básica
+    Autor: Nicolau
+    Tipo: Artigo
+    Descrição: Mecânica clássica
+    Relevância: Base do curso
+    2. Título: Ondas
+    """
+    sources = parse_sources_from_text(text)
+    assert sources == [
+        {
+            "title": "Física Básica",
+            "authors": "Nicolau",
+            "type": "artigo",
+            "description": "Mecânica clássica",
+            "relevance": "Base do curso",
+        },
+        {"title": "Ondas", "authors": "Vários", "type": "livro", "description": "", "relevance": ""},
+    ]
+
+
+def test_parse_sources_uses_free_text_as_description_then_relevance():
+    sources = parse_sources_from_text("- Cálculo\nUm clássico\nUsado nos exercícios\nIgnorado")
+    assert sources[0]["description"] == "Um clássico"
+    assert sources[0]["relevance"] == "Usado nos exercícios"
+
+
+def test_parse_sources_limits_to_twelve():
+    text = "\n".join(f"- Fonte {i}" for i in range(20))
+    assert len(parse_sources_from_text(text)) == 12
+
+
+def test_parse_sources_without_sources():
+    assert parse_sources_from_text("# Cabeçalho\n\n") == []
+
+
+# ============================================================================
+# _command_signature (guarda do cache semântico)
+# ============================================================================
+
+def signature(message):
+    return _command_signature(_normalize_message(message))
+
+
+def test_signature_accepts_synonym_verbs_and_articles():
+    assert signature("Remova o card block1-2") == signature("apague card block1-2")
+    assert signature("adicione um card sobre vetores") == signature("Crie o card sobre vetores")
+
+
+@pytest.mark.parametrize("first, second", [
+    ("adicione um card sobre Python no bloco 1", "adicione um card sobre Java no bloco 1"),
+    ("remova o card block1-2", "remova o card block1-3"),
+    ("crie 3 cards sobre ondas", "crie 5 cards sobre ondas"),
+    ("remova o card block1-2", "adicione o card block1-2"),
+    ('crie o card "Leis de Newton"', 'crie o card "Leis de Kepler"'),
+])
+def test_signature_distinguishes_commands(first, second):
+    assert signature(first) != signature(second)
+
+
+def test_signature_keeps_quoted_terms_whole():
+    assert '"leis de newton"' in signature('Crie o card "Leis de Newton"')